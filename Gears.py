@@ -1,143 +1,279 @@
-import os
 import discord
 import logging
 import asyncio
-from dotenv import load_dotenv
+import re
 from discord.ext import commands
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import datetime
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import data
+import drive
+import guilds
+import journal
+import mirror
+import ocr
+import rest
+import sessions
+import sheets
+import wizard
 
-load_dotenv()  # Загружаем переменные окружения
+bot = None  # Общий бот, задаётся при загрузке расширения в setup()
 
-DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+GEARSCORE_SHEET = "GearScore"  # Лист есть в таблице каждого сервера
 
-# Установка логирования
-logging.basicConfig(level=logging.INFO)
+CLOSE_DELAY = 180  # Через сколько секунд после сохранения закрываем подканал
 
-# Настройка доступа к Google Sheets
-def setup_google_sheets():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-    client = gspread.authorize(creds)
-    return client
+class GearsCog(commands.Cog):
+    """Мастер сбора прогресса снаряжения в канале прогресс."""
 
-client = setup_google_sheets()
-intents = discord.Intents.default()
-intents.message_content = True
+    def __init__(self, bot):
+        self.bot = bot
+        self.restored = False
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Ищем канал по имени один раз, дальше сообщения маршрутизируются по id канала
+        for guild in self.bot.guilds:
+            route_progress_channel(guild)
+        if not self.restored:
+            self.restored = True
+            await progress_wizard.restore(self.bot)
 
-def authenticate_drive():
-    scopes = ['https://www.googleapis.com/auth/drive.file']
-    creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scopes)
-    return build('drive', 'v3', credentials=creds)
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        route_progress_channel(guild)
 
-def upload_image(file_path):
-    drive_service = authenticate_drive()
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        await on_message(message)
 
-    # Создание метаданных для файла
-    file_metadata = {
-        'name': os.path.basename(file_path),
-        'mimeType': 'image/jpeg'  # Укажите правильный тип MIME
-    }
 
-    media = MediaFileUpload(file_path, mimetype='image/jpeg')
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+async def setup(client):
+    global bot
+    bot = client
+    for spreadsheet in guilds.spreadsheets():
+        mirror.watch(GEARSCORE_SHEET, spreadsheet)
+    await client.add_cog(GearsCog(client))
 
-    # Получаем ID загруженного файла
-    file_id = file.get('id')
-    drive_service.permissions().create(fileId=file_id, body={'role': 'reader', 'type': 'anyone'}).execute()
 
-    # Возвращаем прямую ссылку на файл
-    return f'https://drive.google.com/uc?id={file_id}'
-
-@bot.event
-async def on_ready():
-    logging.info(f'Бот успешно запущен как {bot.user}')
-
-@bot.event
 async def on_message(message):
-    if message.author == bot.user:
+    # Всё, что пришло не в наши каналы, отбрасываем до любого форматирования и логирования
+    handler = sessions.route(message.channel.id)
+    if handler is None or message.author.bot:
         return
+    await handler(message)
 
-    if message.channel.name == 'прогресс':  # Проверка канала для сбора данных
-        await create_progress_channel(message.guild, message.author)
 
-async def create_progress_channel(guild, user):
-    category = discord.utils.get(guild.categories, name='Бот')  # Укажите имя категории, если она есть
-    channel_name = f'прогрес-{user.display_name.lower().replace(" ", "-")}'  # Форматирование имени канала
+def route_progress_channel(guild):
+    config = guilds.get(guild.id)
+    channel = discord.utils.get(guild.text_channels, name=config.progress_channel) if config else None
+    if channel is not None:
+        sessions.add_route(channel.id, start_progress)
 
-    # Проверка существования подканала
-    existing_channel = discord.utils.get(guild.text_channels, name=channel_name)
-    if existing_channel:
-        await user.send(f"Канал {channel_name} уже существует. Пожалуйста, продолжайте в этом канале.")
-        return
 
-    # Создание подканала
-    progress_channel = await guild.create_text_channel(channel_name, category=category)
+async def start_progress(message):
+    await create_progress_channel(message.guild, message.author)
 
-    await progress_channel.send("Заполните данные:\nLevel\nВведите ваш уровень:")
-    lvl_msg = await bot.wait_for('message', check=lambda m: m.author == user and m.channel == progress_channel)
-    lvl = lvl_msg.content.strip()
 
-    await progress_channel.send("Введите вашу атаку:")
-    attack_msg = await bot.wait_for('message', check=lambda m: m.author == user and m.channel == progress_channel)
-    attack = attack_msg.content.strip()
+async def close_progress_channel(session):
+    channel = bot.get_channel(session.channel_id) if session.channel_id else None
+    if channel is not None:
+        await rest.delete_channel(channel)
 
-    await progress_channel.send("Введите вашу защиту:")
-    defence_msg = await bot.wait_for('message', check=lambda m: m.author == user and m.channel == progress_channel)
-    defence = defence_msg.content.strip()
 
-    await progress_channel.send("Введите вашу точность:")
-    accuracy_msg = await bot.wait_for('message', check=lambda m: m.author == user and m.channel == progress_channel)
-    accuracy = accuracy_msg.content.strip()
+STAT_ORDER = ['lvl', 'attack', 'defence', 'accuracy', 'gear_score']
+CONFIRM_WORDS = ('да', 'yes', 'ок', 'ok', '+')
 
-    await progress_channel.send("Введите ваш Gear Score:")
-    gear_score_msg = await bot.wait_for('message', check=lambda m: m.author == user and m.channel == progress_channel)
-    gear_score = gear_score_msg.content.strip()
 
-    await progress_channel.send("Прикрепите изображение с вашим Gear Score.")
+def parse_number(text):
+    # «135 834» приходит с пробелами между разрядами; дальше по цепочке идут только цифры
+    text = text.strip().replace(' ', '').replace('\xa0', '')
+    int(text)  # ValueError - повторяем шаг
+    return text
 
-    def check_image(msg):
-        return (msg.attachments and msg.channel == progress_channel and msg.author == user) or \
-               (msg.content.startswith("http") and msg.channel == progress_channel and msg.author == user)
 
-    image_msg = await bot.wait_for('message', check=check_image)
+async def parse_image(message, answers):
+    if message.attachments:
+        image_file = message.attachments[0]
+        # Читаем вложение в память: без временных файлов в рабочем каталоге
+        try:
+            image = await image_file.read()
+            # Загрузка на Google Drive и распознавание идут одновременно
+            link, answers['ocr'] = await asyncio.gather(
+                drive.upload_image(image, image_file.filename, image_file.content_type), ocr.read_stats(image))
+            return link
+        except Exception as e:
+            logging.error("Ошибка при загрузке изображения: %s", e)
+            raise ValueError("Не удалось загрузить изображение, попробуйте ещё раз.")
+    if message.content.startswith("http"):
+        answers['ocr'] = {}  # По ссылке ничего не скачиваем, значения введут вручную
+        return message.content.strip()  # берём текстовый контент как ссылку
+    raise ValueError("Прикрепите изображение или пришлите ссылку на него.")
 
-    if image_msg.attachments:
-        image_file = image_msg.attachments[0]
-        local_file_path = f'./{image_file.filename}'  # Сохранение файла локально
-        await image_file.save(local_file_path)  # Сохранение файла
-        gs_image = upload_image(local_file_path)  # Загрузка на Google Drive
-    else:
-        gs_image = image_msg.content.strip()  # берём текстовый контент как ссылку
 
+def missing_stats(answers):
+    recognized = answers.get('ocr') or {}
+    return [key for key in STAT_ORDER if not recognized.get(key)]
+
+
+def confirm_prompt(answers):
+    recognized = answers.get('ocr') or {}
+    missing = missing_stats(answers)
+    lines = [f"{ocr.STAT_NAMES[key]}: {recognized.get(key) or '—'}" for key in STAT_ORDER]
+    if not missing:
+        head = "Распознано со скриншота:"
+        tail = "Отправьте «да», чтобы сохранить, или пришлите исправленные значения."
+    elif len(missing) < len(STAT_ORDER):
+        # Уровня на скриншоте нет: достаточно дописать то, что не распознано
+        names = ", ".join(ocr.STAT_NAMES[key].lower() for key in missing)
+        head = "Распознано со скриншота:"
+        tail = f"Пришлите недостающее ({names}) или все значения, чтобы их исправить."
+    else:
+        head = "Не все значения удалось распознать:"
+        tail = "Пришлите значения вручную."
+    return (f"{head}\n" + "\n".join(lines) + f"\n{tail}\n"
+            "Формат: уровень, атака, защита, точность, Gear Score - через запятую или каждое с новой строки.")
+
+
+def parse_confirm(message, answers):
+    text = message.content.strip()
+    recognized = answers.get('ocr') or {}
+    missing = missing_stats(answers)
+    if text.lower() in CONFIRM_WORDS:
+        if missing:
+            raise ValueError("Не все значения распознаны, пришлите их вручную.")
+        return {key: recognized[key] for key in STAT_ORDER}
+
+    values = [value for value in re.split(r'[,;\n]+', text) if value.strip()]
+    if missing and len(values) == len(missing) < len(STAT_ORDER):
+        keys = missing
+    elif len(values) == len(STAT_ORDER):
+        keys = STAT_ORDER
+    else:
+        raise ValueError(f"Нужно {len(STAT_ORDER)} чисел: уровень, атака, защита, точность, Gear Score.")
+    try:
+        stats = {key: recognized[key] for key in STAT_ORDER if key not in keys}
+        stats.update((key, parse_number(value)) for key, value in zip(keys, values))
+        return stats
+    except ValueError:
+        raise ValueError("Все значения должны быть числами, попробуйте ещё раз.")
+
+
+async def complete_progress(session, channel, answers):
+    stats = answers['stats']
+    # Таблицу запоминаем при открытии мастера; у мастеров, начатых раньше, берём её по серверу канала
+    spreadsheet = answers.get('spreadsheet')
+    if spreadsheet is None:
+        config = guilds.get(channel.guild.id)
+        spreadsheet = config.spreadsheet if config else None
+    if spreadsheet is None:
+        await rest.send(channel, "Этот сервер не настроен, данные не сохранены.")
+        progress_wizard.finish(session, CLOSE_DELAY)
+        return
     # Сохранение данных в таблицу Google Sheets
-    await record_progress(user.display_name, lvl, gear_score, attack, defence, accuracy, gs_image)
+    if await record_progress(answers['nickname'], stats['lvl'], stats['gear_score'], stats['attack'],
+                             stats['defence'], stats['accuracy'], answers['image'], spreadsheet):
+        await rest.send(channel, "Данные успешно сохранены! Подканал будет закрыт через 3 минуты.")
+    else:
+        await rest.send(channel, "Не удалось сохранить данные: уровень, атака, защита, точность и Gear Score "
+                                 "должны быть числами. Подканал будет закрыт через 3 минуты.")
+    # Подканал закроет общая задача очистки сессий
+    progress_wizard.finish(session, CLOSE_DELAY)
+
 
-    await progress_channel.send("Данные успешно сохранены! Подканал будет закрыт через 3 минуты.")
-    await asyncio.sleep(180)  # 3 минуты ожидания
-    await progress_channel.delete()
+# Вместо шести вопросов: скриншот, затем подтверждение или исправление распознанных чисел
+progress_wizard = wizard.Wizard('progress', [
+    wizard.Step('image', "Прикрепите изображение с вашим Gear Score.", parse_image),
+    wizard.Step('stats', confirm_prompt, parse_confirm),
+], on_complete=complete_progress, on_expire=close_progress_channel)
 
-async def record_progress(nickname, lvl, gear_score, attack, defence, accuracy, image):
+
+async def create_progress_channel(guild, user):
+    config = guilds.get(guild.id)
+    if config is None:
+        return  # Сервер не описан в guilds.json: прогресс писать некуда
+    # Сессия ищется по id пользователя: смена ника не ломает проверку
+    session = sessions.get('progress', user.id)
+    if session is not None:
+        if session.channel_id is not None:
+            await rest.send(user, f"Канал <#{session.channel_id}> уже существует. "
+                                  "Пожалуйста, продолжайте в этом канале.")
+        return
     try:
-        sheet_name = "GearScore"
-        worksheet = client.open("NightCrowsApp").worksheet(sheet_name)
+        session = progress_wizard.open(user.id)
+    except sessions.SessionLimitError as e:
+        await rest.send(user, str(e))
+        return
+    # Ник запоминаем сразу: он станет ключом строки в таблице
+    session.data['answers']['nickname'] = user.display_name
+    session.data['answers']['spreadsheet'] = config.spreadsheet
 
-        # Поиск существующего ника в таблице
-        nicknames = worksheet.col_values(1)
-        if nickname in nicknames:
-            row = nicknames.index(nickname) + 1
+    category = discord.utils.get(guild.categories, name=config.category)  # Категория из настроек сервера
+    channel_name = f'прогрес-{user.display_name.lower().replace(" ", "-")}'  # Форматирование имени канала
+
+    # Создание подканала
+    try:
+        progress_channel = await guild.create_text_channel(channel_name, category=category)
+    except discord.HTTPException:
+        sessions.close(session)
+        raise
+    await progress_wizard.begin(session, progress_channel)
+
+async def record_progress(nickname, lvl, gear_score, attack, defence, accuracy, image, spreadsheet):
+    """Сохраняет прогресс в локальный журнал; в таблицу его выгрузит фоновая задача."""
+    try:
+        # Проверяем числа сразу: запись, которую нельзя разобрать, застряла бы в журнале навсегда
+        int(lvl), int(attack), int(defence), int(accuracy)
+        int(gear_score.replace(' ', '').replace(' ', ''))
+    except ValueError as e:
+        logging.error("Ошибка при записи прогресса: %s", e)
+        return False
+
+    journal.append('progress', {'spreadsheet': spreadsheet,
+                                'row': [nickname, lvl, gear_score, attack, defence, accuracy, image]})
+    return True
+
+
+async def commit_progress(entries):
+    """Выгружает прогресс из журнала. Возвращает id неотправленных записей."""
+    failed = []
+    for spreadsheet, group in data.by_spreadsheet(entries).items():
+        for entry_id, row in group:
+            if not await write_progress(spreadsheet, *row):
+                failed.append(entry_id)
+    return failed
 
-            # Получаем прошлые значения
-            old_lvl = worksheet.cell(row, 2).value
-            old_gear_score = worksheet.cell(row, 3).value
-            old_attack = worksheet.cell(row, 5).value
-            old_defence = worksheet.cell(row, 7).value
-            old_accuracy = worksheet.cell(row, 9).value
+
+async def find_progress_row(worksheet, sheet, nickname):
+    """Номер строки игрока и его прошлые значения B:L (None, если игрока ещё нет)."""
+    if mirror.is_fresh(sheet):
+        # Свежая локальная копия: обходимся без запросов к Google
+        found = mirror.find(sheet, nickname)
+        if found is None:
+            return None, []
+        row, cells = found
+        return row, cells[1:12]
+
+    # Поиск существующего ника в таблице
+    nicknames = await sheets.call(worksheet.col_values, 1)
+    if nickname not in nicknames:
+        return None, []
+    row = nicknames.index(nickname) + 1
+
+    # Получаем прошлые значения одним запросом по строке B:L
+    old_row = await sheets.call(worksheet.get, f"B{row}:L{row}")
+    return row, old_row[0] if old_row else []
+
+
+async def write_progress(spreadsheet, nickname, lvl, gear_score, attack, defence, accuracy, image):
+    try:
+        worksheet = await sheets.get_worksheet(GEARSCORE_SHEET, spreadsheet)
+        sheet = mirror.sheet_key(GEARSCORE_SHEET, spreadsheet)
+
+        row, old_row = await find_progress_row(worksheet, sheet, nickname)
+        if row is not None:
+            row_range = f"B{row}:L{row}"
+            old_row = list(old_row) + [''] * 11
+            old_lvl, old_gear_score, old_attack, old_defence, old_accuracy = \
+                old_row[0], old_row[1], old_row[3], old_row[5], old_row[7]
 
             # Логируем старые значения
             logging.debug("Старые значения для %s: Уровень=%s, GearScore=%s, Attack=%s, Defence=%s, Accuracy=%s",
@@ -156,38 +292,37 @@ async def record_progress(nickname, lvl, gear_score, attack, defence, accuracy,
 
             logging.debug("Новые значения: GearScore=%s, Изменение GS=%s", new_gear_score, gs_change)
 
-            # Обновляем таблицу
-            worksheet.update_cell(row, 2, int(lvl))
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 3, new_gear_score)  # Записываем новое значение GearScore
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 4, gs_change)  # Записываем изменение GearScore
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 5, int(attack))  # Attack
-            # Изменение Attack
-            worksheet.update_cell(row, 6, int(attack) - old_attack)
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 7, int(defence))  # Defence
-            worksheet.update_cell(row, 8, int(defence) - old_defence)  # Изменение Defence
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 9, int(accuracy))  # Accuracy
-            worksheet.update_cell(row, 10, int(accuracy) - old_accuracy)  # Изменение Accuracy
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 11, image)
-            await asyncio.sleep(0.1)
-            worksheet.update_cell(row, 12, datetime.datetime.now().strftime('%d.%m.%Y'))  # Date
-            await asyncio.sleep(0.1)
+            # Обновляем всю строку B:L одним запросом
+            new_row = [
+                int(lvl),
+                new_gear_score,  # Новое значение GearScore
+                gs_change,  # Изменение GearScore
+                int(attack),  # Attack
+                int(attack) - old_attack,  # Изменение Attack
+                int(defence),  # Defence
+                int(defence) - old_defence,  # Изменение Defence
+                int(accuracy),  # Accuracy
+                int(accuracy) - old_accuracy,  # Изменение Accuracy
+                image,
+                datetime.datetime.now().strftime('%d.%m.%Y'),  # Date
+            ]
+            await sheets.call(worksheet.update, range_name=row_range, values=[new_row],
+                              value_input_option='USER_ENTERED')
+            mirror.put_row(sheet, row, [nickname] + [str(value) for value in new_row])
 
             logging.info("Данные о прогрессе успешно обновлены для %s", nickname)
         else:
             new_gear_score = int(gear_score.replace(' ', '').replace(' ', ''))  # Очищаем пробелы
-            worksheet.append_row([nickname, int(lvl), new_gear_score, '', int(attack), '', int(defence), '',
-                                  int(accuracy), '', image, datetime.datetime.now().strftime('%d.%m.%Y')])
+            new_row = [nickname, int(lvl), new_gear_score, '', int(attack), '', int(defence), '', int(accuracy), '',
+                       image, datetime.datetime.now().strftime('%d.%m.%Y')]
+            await sheets.call(worksheet.append_row, new_row)
+            mirror.append_rows(sheet, [new_row])
             logging.info("Данные о прогрессе успешно записаны для %s", nickname)
-
-        await asyncio.sleep(1)
+        return True
 
     except Exception as e:
         logging.error("Ошибка при записи прогресса: %s", e)
+        return False
+
 
-bot.run(DISCORD_TOKEN)
\ No newline at end of file
+journal.register('progress', commit_progress)
@@ -1,73 +1,310 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import abc
+import array
 import asyncio
-import os
-import discord
-from dotenv import load_dotenv
+import datetime
+import logging
+import re
+import time
+import aiohttp
+from bs4 import BeautifulSoup
+from discord.ext import commands
+import rest
 
-load_dotenv()  # Загружаем переменные окружения из .env файла
-
-DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 CHANNEL_ID = 1285475306442063992  # Используйте ID вашего канала
 
-# Создаем intents
-intents = discord.Intents.default()
-intents.messages = True  # Разрешаем боту получать события сообщений
+POLL_INTERVAL = 900  # Задержка между проверками (15 минут)
+REQUEST_TIMEOUT = 20  # Секунды на один запрос к источнику цены
+TOKENS_URL = 'https://wemixplay.com/tokens?search={symbol}'
+
+# Токен -> цена, начиная с которой отправляем уведомление
+WATCHES = {
+    'CROW': 0.75,
+}
+HISTORY_SIZE = 96  # Сколько замеров храним: сутки при опросе раз в 15 минут
+AVERAGE_WINDOW = 4  # Скользящее среднее за последний час
+# Уведомление снова взводится, только когда цена опустится на 5% ниже порога,
+# чтобы колебания около порога не слали уведомление на каждом опросе
+HYSTERESIS = 0.05
+
+bot = None  # Общий бот, задаётся при загрузке расширения в setup()
+price_task = None
+http = None  # Общая сессия aiohttp: соединения с источниками переиспользуются
+
+
+class PriceHistory:
+    """Кольцевой буфер замеров цены; среднее и изменение считаются за O(1) на замер."""
+
+    def __init__(self, size=HISTORY_SIZE, window=AVERAGE_WINDOW):
+        self.size = size
+        self.window = min(window, size)
+        self.prices = array.array('d', bytes(8 * size))
+        self.times = array.array('d', bytes(8 * size))
+        self.start = 0  # Индекс самого старого замера
+        self.count = 0
+        self.window_sum = 0.0
+
+    def at(self, offset):
+        """Индекс замера, offset - номер от самого старого."""
+        return (self.start + offset) % self.size
+
+    def append(self, price, when=None):
+        if self.count >= self.window:
+            # Замер, выходящий из окна среднего, ещё лежит в буфере: окно не больше буфера
+            self.window_sum -= self.prices[self.at(self.count - self.window)]
+        if self.count == self.size:
+            index = self.start
+            self.start = (self.start + 1) % self.size
+        else:
+            index = self.at(self.count)
+            self.count += 1
+        self.prices[index] = price
+        self.times[index] = time.time() if when is None else when
+        self.window_sum += price
+
+    def latest(self):
+        if not self.count:
+            return None, None
+        index = self.at(self.count - 1)
+        return self.prices[index], self.times[index]
+
+    def average(self):
+        if not self.count:
+            return None
+        return self.window_sum / min(self.count, self.window)
+
+    def change(self):
+        """Изменение цены в процентах от самого старого замера в буфере."""
+        if self.count < 2:
+            return None
+        oldest = self.prices[self.start]
+        if not oldest:
+            return None
+        return (self.prices[self.at(self.count - 1)] - oldest) / oldest * 100
+
+
+class ThresholdAlert:
+    """Порог с гистерезисом: срабатывает при пересечении вверх и взводится после отката вниз."""
+
+    def __init__(self, threshold, hysteresis=HYSTERESIS):
+        self.threshold = threshold
+        self.rearm_below = threshold * (1 - hysteresis)
+        self.armed = True
+
+    def update(self, price):
+        if self.armed and price >= self.threshold:
+            self.armed = False
+            return True
+        if not self.armed and price < self.rearm_below:
+            self.armed = True
+        return False
+
+
+histories = {symbol: PriceHistory() for symbol in WATCHES}
+alerts = {symbol: ThresholdAlert(threshold) for symbol, threshold in WATCHES.items()}
+
+
+class HttpSource(abc.ABC):
+    """Источник цен по HTTP с условными запросами: неизменившаяся страница не скачивается заново.
+
+    fetch() возвращает {токен: цена} для всех токенов, что удалось найти; разбор ответа -
+    в parse() подкласса.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        self.prices = {}
+
+    async def fetch(self, session):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
 
-client = discord.Client(intents=intents)
+        async with session.get(self.url, headers=headers) as response:
+            if response.status == 304:
+                return self.prices  # Не изменилось с прошлого раза
+            response.raise_for_status()
+            body = await response.text()
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+
+        self.prices = self.parse(body)
+        return self.prices
+
+    @abc.abstractmethod
+    def parse(self, body):
+        """Разбирает тело ответа в {токен: цена}."""
+
+
+class HtmlSource(HttpSource):
+    """Страница со списком токенов: цена берётся из строки таблицы с символом токена."""
+
+    def __init__(self, url, symbols):
+        super().__init__(url)
+        self.symbols = symbols
+
+    def parse(self, body):
+        soup = BeautifulSoup(body, 'html.parser')
+        prices = {}
+        for row in soup.find_all('tr'):
+            text = row.get_text(' ', strip=True)
+            for symbol in self.symbols:
+                if symbol in prices or not re.search(rf'\b{re.escape(symbol)}\b', text):
+                    continue
+                match = re.search(r'\$\s*([0-9][0-9.,]*)', text)
+                if not match:
+                    continue
+                price = parse_price(match.group(1))
+                if price is None:
+                    logging.warning("Не удалось однозначно разобрать цену токена %s: %s", symbol, match.group(0))
+                    continue
+                prices[symbol] = price
+        return prices
+
+
+def thousands_groups(groups):
+    """Похожи ли части числа на разряды: первая - 1-3 цифры без ведущего нуля, остальные по 3."""
+    return (re.fullmatch(r'[1-9][0-9]{0,2}', groups[0]) is not None
+            and all(re.fullmatch(r'[0-9]{3}', group) for group in groups[1:]))
+
+
+def parse_price(text):
+    """Цена из записи с разделителями разрядов: «1,234.56», «1.234,56», «0,75».
+
+    Возвращает None, если запись можно прочитать двояко («1,234» - тысяча или
+    единица с дробью) или она не похожа на число.
+    """
+    text = text.rstrip('.,')  # Точка или запятая сразу после числа - это уже текст
+    if ',' in text and '.' in text:
+        # Десятичный разделитель - последний, второй разделяет разряды
+        decimal = '.' if text.rfind('.') > text.rfind(',') else ','
+        integer, _, fraction = text.rpartition(decimal)
+        groups = integer.split(',' if decimal == '.' else '.')
+        if decimal in integer or not thousands_groups(groups):
+            return None
+        return float(''.join(groups) + '.' + fraction)
+
+    separator = ',' if ',' in text else '.' if '.' in text else None
+    if separator is None:
+        return float(text)
+    parts = text.split(separator)
+    if len(parts) > 2:
+        # Несколько одинаковых разделителей бывают только между разрядами
+        return float(''.join(parts)) if thousands_groups(parts) else None
+    if thousands_groups(parts):
+        return None  # «1,234»: три цифры после разделителя - разряды или дробь, не понять
+    return float(parts[0] + '.' + parts[1])
+
+
+# Источники опрашиваются по порядку; цена токена берётся из первого, где он нашёлся
+sources = [HtmlSource(TOKENS_URL.format(symbol=symbol), [symbol]) for symbol in WATCHES]
+
+
+def get_http():
+    global http
+    if http is None or http.closed:
+        http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4, keepalive_timeout=POLL_INTERVAL + 60),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+    return http
 
 
 async def send_message(channel, message):
-    await channel.send(message)
+    await rest.send(channel, message)
+
+
+async def fetch_prices():
+    """Один цикл опроса всех источников."""
+    prices = {}
+    session = get_http()
+    for source in sources:
+        try:
+            for symbol, price in (await source.fetch(session)).items():
+                prices.setdefault(symbol, price)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logging.error("Ошибка при получении цены токена: %s", e)
+    return prices
 
 
 async def check_price():
     """Асинхронная функция для проверки цены."""
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Включаем headless режим
-    chrome_options.add_argument("--no-sandbox")  # Убираем песочницу
-    chrome_options.add_argument("--disable-dev-shm-usage")  # Отключаем использование памяти Docker
+    while True:
+        try:
+            await poll_prices()
+        except Exception:
+            # Любая ошибка одного опроса не должна останавливать слежение за ценой
+            logging.exception("Ошибка при проверке цены токенов")
+        await asyncio.sleep(POLL_INTERVAL)
 
-    service = Service()
-    driver = webdriver.Chrome(service=service, options=chrome_options)
 
-    try:
-        driver.get('https://wemixplay.com/tokens?search=CROW')
+async def poll_prices():
+    prices = await fetch_prices()
+    for symbol in WATCHES:
+        current_price = prices.get(symbol)
+        if current_price is None:
+            logging.warning("Цена токена %s не найдена ни в одном источнике", symbol)
+            continue
+        logging.info("Текущая цена токена %s: $%s", symbol, current_price)
+        histories[symbol].append(current_price)
 
-        while True:
-            driver.refresh()  # Обновляем страницу
+        if alerts[symbol].update(current_price):
+            channel = bot.get_channel(CHANNEL_ID)
+            message = f"@everyone Чеканка {symbol} доступна! Текущая цена на бирже за 24ч: ${current_price:.2f}"
+            try:
+                await send_message(channel, message)  # Отправляем сообщение
+            except Exception as e:
+                logging.error("Ошибка при отправке уведомления о цене: %s", e)
+                alerts[symbol].armed = True  # Попробуем снова на следующем опросе
 
-            price_element = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.XPATH,
-                                                '/html/body/div[1]/div[3]/main/div/div[2]/div/div/div[2]/div[1]/div/article[2]/div/div[1]/div/table/tbody/tr[1]/td[2]/button/div/p'))
-            )
 
-            current_price = float(price_element.text.strip().replace('$', ''))
-            print(f'Текущая цена токена: ${current_price}')
+class PriceCog(commands.Cog):
+    """Следит за ценой токенов."""
 
-            if current_price >= 0.75:
-                channel = client.get_channel(CHANNEL_ID)
-                message = f"@everyone Чеканка CROW доступна! Текущая цена на бирже за 24ч: ${current_price:.2f}"
-                await send_message(channel, message)  # Отправляем сообщение
-                break
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        global price_task
+        # on_ready приходит и после переподключения: проверку запускаем один раз
+        if price_task is None:
+            price_task = asyncio.create_task(check_price())  # Запускаем проверку цены в фоне
 
-            await asyncio.sleep(900)  # Общая задержка перед следующей проверкой (15 минут)
+    @commands.command(name='price', aliases=['цена'])
+    async def price(self, ctx):
+        """Последние цены токенов из памяти, без обращения к сайту."""
+        await rest.send(ctx.channel, price_report())
 
-    except Exception as e:
-        print("Ошибка при получении цены токена:", e)
-    finally:
-        driver.quit()
+    async def cog_unload(self):
+        global price_task
+        if price_task is not None:
+            price_task.cancel()
+            price_task = None
+        if http is not None:
+            await http.close()
 
 
-@client.event
-async def on_ready():
-    print(f'Зашел как {client.user}')
-    await check_price()  # Запускаем проверку цены в основном асинхронном контексте
+def price_report():
+    lines = []
+    for symbol, history in histories.items():
+        price, when = history.latest()
+        if price is None:
+            lines.append(f"{symbol}: цена ещё не получена")
+            continue
+        line = f"{symbol}: ${price:.4f} (среднее за час ${history.average():.4f}"
+        change = history.change()
+        if change is not None:
+            period = "за сутки" if history.count == history.size else "с запуска"
+            line += f", {period} {change:+.1f}%"
+        updated = datetime.datetime.fromtimestamp(when).strftime("%d.%m.%Y %H:%M")
+        lines.append(f"{line}; обновлено {updated})")
+    return "\n".join(lines)
 
 
-# Запуск клиента Discord
-client.run(DISCORD_TOKEN)
\ No newline at end of file
+async def setup(client):
+    global bot
+    bot = client
+    await client.add_cog(PriceCog(client))
@@ -0,0 +1,205 @@
+import discord
+import logging
+from discord.ext import commands
+import data
+import guilds
+import rest
+import sessions
+import datetime
+
+bot = None  # Общий бот, задаётся при загрузке расширения в setup()
+
+REPORT_TIMEOUT = 300  # Сколько секунд живёт форма отчёта
+
+# Маппинг боссов для разных уровней сложности
+boss_mapping_normal = {
+    '🐞': "Anggolt",
+    '🐎': "Kiaron",
+    '🐗': "Grish",
+    '🦁': "Inferno"
+}
+
+boss_mapping_chaos = {
+    '🐞': "Liantte",
+    '🐎': "Seyron",
+    '🐗': "Gottmol",
+    '🦁': "Gehenna"
+}
+
+
+def boss_options(boss_mapping):
+    return [discord.SelectOption(label=name, value=name, emoji=emoji) for emoji, name in boss_mapping.items()]
+
+
+def mark_selected(select, value):
+    # После edit_message выбор в списке сбрасывается, если не отметить его как default
+    for option in select.options:
+        option.default = option.value == value
+
+
+class KillReportPanel(discord.ui.View):
+    """Постоянная кнопка в канале arena, с которой начинается отчёт."""
+
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @discord.ui.button(label="Сообщить об убийстве | Report a kill", emoji="⚔️",
+                       style=discord.ButtonStyle.primary, custom_id="arena:report")
+    async def report(self, interaction, button):
+        config = guilds.get(interaction.guild_id)
+        if config is None:
+            await interaction.response.send_message("Этот сервер не настроен для отчётов.", ephemeral=True)
+            return
+        # Эфемерную форму пользователь может просто закрыть, поэтому повторное
+        # нажатие не блокируется, а заменяет его прежнюю форму
+        previous = sessions.get('arena', interaction.user.id)
+        if previous is not None:
+            previous.data['view'].stop()
+            sessions.close(previous)
+        try:
+            session = sessions.open('arena', interaction.user.id, REPORT_TIMEOUT)
+        except sessions.SessionLimitError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+
+        logging.info("Отчёт об убийстве начат пользователем: %s", interaction.user.display_name)
+        view = KillReportView(session, config.spreadsheet)
+        session.data['view'] = view
+        # Форма видна только автору: никаких отдельных каналов и реакций
+        await interaction.response.send_message(
+            "Выберите сложность, канал и босса, затем укажите уровень зоны.\n"
+            "Choose the difficulty, channel and boss, then enter the zone level.",
+            view=view, ephemeral=True)
+
+
+class KillReportView(discord.ui.View):
+    """Эфемерная форма отчёта: сложность, канал, босс и уровень зоны."""
+
+    def __init__(self, session, spreadsheet):
+        super().__init__(timeout=REPORT_TIMEOUT)
+        self.session = session
+        self.spreadsheet = spreadsheet  # Убийство пишется в таблицу того сервера, где нажата кнопка
+        self.difficulty_level = None
+        self.selected_channel_number = None
+        self.boss_name = None
+        self.boss_select.disabled = True
+        self.zone_button.disabled = True
+
+    @discord.ui.select(placeholder="Сложность | Difficulty", row=0, options=[
+        discord.SelectOption(label="Обычный | Normal", value="Обычный", emoji="😇"),
+        discord.SelectOption(label="Хаос | Chaos", value="Хаос", emoji="😈"),
+    ])
+    async def difficulty_select(self, interaction, select):
+        self.difficulty_level = select.values[0]
+        mark_selected(select, self.difficulty_level)
+
+        # В зависимости от выбранной сложности, используем соответствующий список боссов
+        boss_mapping = boss_mapping_normal if self.difficulty_level == "Обычный" else boss_mapping_chaos
+        self.boss_name = None
+        self.boss_select.options = boss_options(boss_mapping)
+        self.boss_select.disabled = False
+        await self.refresh(interaction)
+
+    @discord.ui.select(placeholder="Канал | Channel", row=1, options=[
+        discord.SelectOption(label="Канал 1 | Channel 1", value="Канал 1", emoji="1️⃣"),
+        discord.SelectOption(label="Канал 2 | Channel 2", value="Канал 2", emoji="2️⃣"),
+    ])
+    async def channel_select(self, interaction, select):
+        self.selected_channel_number = select.values[0]
+        mark_selected(select, self.selected_channel_number)
+        await self.refresh(interaction)
+
+    @discord.ui.select(placeholder="Босс | Boss", row=2, options=boss_options(boss_mapping_normal))
+    async def boss_select(self, interaction, select):
+        self.boss_name = select.values[0]
+        mark_selected(select, self.boss_name)
+        await self.refresh(interaction)
+
+    @discord.ui.button(label="Уровень зоны | Zone level", style=discord.ButtonStyle.success, row=3)
+    async def zone_button(self, interaction, button):
+        await interaction.response.send_modal(ZoneModal(self))
+
+    async def refresh(self, interaction):
+        self.zone_button.disabled = not (self.difficulty_level and self.selected_channel_number and self.boss_name)
+        await interaction.response.edit_message(view=self)
+
+    async def submit(self, interaction, zone):
+        logging.info("%s сообщил об убийстве: %s, %s, %s, зона %s", interaction.user.display_name, self.boss_name,
+                     self.difficulty_level, self.selected_channel_number, zone)
+
+        kill_time = datetime.datetime.now().strftime("%d.%m.%Y %H:%M")
+        if await data.record_boss_kill(self.boss_name, kill_time, zone, self.difficulty_level,
+                                       self.selected_channel_number, spreadsheet=self.spreadsheet):
+            content = "Данные о убийстве босса успешно записаны в таблицу."
+        else:
+            content = "Не удалось записать данные о убийстве босса."
+        self.stop()
+        sessions.close(self.session)
+        await interaction.response.edit_message(content=content, view=None)
+
+    async def on_timeout(self):
+        sessions.close(self.session)
+
+
+class ZoneModal(discord.ui.Modal, title="Уровень зоны | Zone level"):
+    zone = discord.ui.TextInput(label="Уровень зоны, где был убит босс", placeholder="Zone level", max_length=10)
+
+    def __init__(self, report):
+        super().__init__()
+        self.report = report
+
+    async def on_submit(self, interaction):
+        await self.report.submit(interaction, str(self.zone).strip())
+
+
+class ArenaCog(commands.Cog):
+    """Отчёт об убийстве босса через кнопку в канале arena."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.panels_ready = False
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready приходит и после переподключения: панели проверяем один раз
+        if not self.panels_ready:
+            self.panels_ready = True
+            await ensure_report_panels()
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        await ensure_report_panel(guild)
+
+
+async def setup(client):
+    global bot
+    bot = client
+    # Постоянная View: кнопка продолжает работать после перезапуска бота
+    client.add_view(KillReportPanel())
+    await client.add_cog(ArenaCog(client))
+
+
+async def ensure_report_panels():
+    """Публикует кнопку отчёта в канале arena, если её там ещё нет."""
+    for guild in bot.guilds:
+        await ensure_report_panel(guild)
+
+
+async def ensure_report_panel(guild):
+    config = guilds.get(guild.id)
+    if config is None:
+        return  # Сервер не описан в guilds.json
+    channel = discord.utils.get(guild.text_channels, name=config.arena_channel)
+    if channel is None:
+        return
+
+    try:
+        async for message in channel.history(limit=50):
+            if message.author == bot.user and message.components:
+                break
+        else:
+            await rest.send(channel, "Убили босса? Нажмите кнопку ниже.\nKilled a boss? Press the button below.",
+                            view=KillReportPanel())
+            logging.info("Кнопка отчёта опубликована в канале %s сервера %s", channel.name, guild.name)
+    except discord.HTTPException as e:
+        logging.error("Ошибка при публикации кнопки отчёта: %s", e)
@@ -0,0 +1,406 @@
+import asyncio
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+import gspread
+
+# Заглушки Google Sheets и Discord для замеров без сети. Вызовы считаются,
+# задерживаются на заданную задержку, а Sheets ещё и отвечают 429 при
+# превышении квоты - как настоящий API.
+
+A1_RE = re.compile(r'^([A-Z]*)(\d*)$')
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def parse_a1(cell):
+    """'B3' -> (3, 2); отсутствующая часть возвращается как None."""
+    match = A1_RE.match(cell.upper())
+    if match is None:
+        raise ValueError(f"Неверный адрес ячейки: {cell}")
+    letters, digits = match.groups()
+    return (int(digits) if digits else None), (column_number(letters) if letters else None)
+
+
+def parse_range(range_name):
+    start, _, end = range_name.partition(':')
+    first = parse_a1(start)
+    last = parse_a1(end) if end else first
+    return first, last
+
+
+class FakeResponse:
+    """Ответ с ошибкой в том виде, который ожидает gspread.exceptions.APIError."""
+
+    def __init__(self, code, message, status):
+        self.status_code = code
+        self.payload = {"error": {"code": code, "message": message, "status": status}}
+        self.text = json.dumps(self.payload)
+
+    def json(self):
+        return self.payload
+
+
+class FakeGoogle:
+    """Клиент gspread: общая квота, задержка и учёт вызовов для всех листов."""
+
+    def __init__(self, latency=0.2, quota=60):
+        self.latency = latency
+        self.quota = quota  # Запросов в минуту
+        self.lock = threading.Lock()
+        self.window = collections.deque()
+        self.calls = collections.Counter()  # (операция, лист) -> количество
+        self.rejected = 0
+        self.spreadsheets = {}
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.rejected = 0
+
+    def request(self, op, title=None):
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] >= 60:
+                self.window.popleft()
+            if len(self.window) >= self.quota:
+                self.rejected += 1
+                raise gspread.exceptions.APIError(
+                    FakeResponse(429, "Quota exceeded for quota metric 'Read requests'", "RESOURCE_EXHAUSTED"))
+            self.window.append(now)
+            self.calls[(op, title)] += 1
+        time.sleep(self.latency)  # gspread блокирует поток на время запроса
+
+    def create(self, name):
+        """Создаёт таблицу без обращения к квоте - для подготовки данных."""
+        return self.spreadsheets.setdefault(name, FakeSpreadsheet(self, name))
+
+    def open(self, name):
+        self.request('open')
+        if name not in self.spreadsheets:
+            raise gspread.exceptions.SpreadsheetNotFound(name)
+        return self.spreadsheets[name]
+
+
+class FakeSpreadsheet:
+    def __init__(self, google, name):
+        self.google = google
+        self.name = name
+        self.sheets = {}
+
+    def add(self, title, values):
+        """Создаёт лист с данными без обращения к квоте."""
+        worksheet = FakeWorksheet(self.google, title, values, sheet_id=len(self.sheets))
+        self.sheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        self.google.request('worksheet', title)
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.google.request('add_worksheet', title)
+        worksheet = self.add(title, [])
+        worksheet.row_count, worksheet.col_count = rows, cols
+        return worksheet
+
+    def worksheets(self):
+        self.google.request('worksheets')
+        return list(self.sheets.values())
+
+    def batch_update(self, body):
+        """Поддерживает appendCells и deleteDimension по строкам."""
+        self.google.request('spreadsheet_batch_update')
+        by_id = {worksheet.id: worksheet for worksheet in self.sheets.values()}
+        for request in body['requests']:
+            if 'appendCells' in request:
+                append = request['appendCells']
+                worksheet = by_id[append['sheetId']]
+                for row in append['rows']:
+                    worksheet.cells.append([next(iter(cell['userEnteredValue'].values())) for cell in row['values']])
+                worksheet.row_count = max(worksheet.row_count, len(worksheet.cells))
+            elif 'deleteDimension' in request:
+                span = request['deleteDimension']['range']
+                del by_id[span['sheetId']].cells[span['startIndex']:span['endIndex']]
+
+
+class FakeWorksheet:
+    """Лист в памяти с подмножеством методов gspread, которыми пользуется бот."""
+
+    def __init__(self, google, title, values, sheet_id=0):
+        self.google = google
+        self.title = title
+        self.id = sheet_id
+        self.cells = [[str(cell) for cell in row] for row in values]
+        self.row_count = max(1000, len(self.cells))
+        self.col_count = max(26, max((len(row) for row in self.cells), default=0))
+
+    def request(self, op):
+        self.google.request(op, self.title)
+
+    def set_cell(self, row, col, value):
+        while len(self.cells) < row:
+            self.cells.append([])
+        cells = self.cells[row - 1]
+        cells.extend([''] * (col - len(cells)))
+        cells[col - 1] = '' if value is None else str(value)
+        self.row_count = max(self.row_count, row)
+        self.col_count = max(self.col_count, col)
+
+    def write(self, range_name, values):
+        (row, col), _ = parse_range(range_name)
+        for row_offset, row_values in enumerate(values):
+            for col_offset, value in enumerate(row_values):
+                self.set_cell(row + row_offset, col + col_offset, value)
+
+    def get_all_values(self):
+        self.request('get_all_values')
+        width = max((len(row) for row in self.cells), default=0)
+        return [row + [''] * (width - len(row)) for row in self.cells]
+
+    def get(self, range_name):
+        self.request('get')
+        (first_row, first_col), (last_row, last_col) = parse_range(range_name)
+        first_row, first_col = first_row or 1, first_col or 1
+        last_row = last_row or len(self.cells)
+        rows = []
+        for row in self.cells[first_row - 1:last_row]:
+            values = row[first_col - 1:last_col]
+            while values and values[-1] == '':
+                values.pop()
+            rows.append(values)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def col_values(self, col):
+        self.request('col_values')
+        values = [row[col - 1] if len(row) >= col else '' for row in self.cells]
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def batch_update(self, data, value_input_option=None):
+        self.request('batch_update')
+        for update in data:
+            self.write(update['range'], update['values'])
+
+    def update(self, range_name=None, values=None, value_input_option=None):
+        self.request('update')
+        self.write(range_name, values)
+
+    def update_cell(self, row, col, value):
+        self.request('update_cell')
+        self.set_cell(row, col, value)
+
+    def append_rows(self, values, value_input_option=None):
+        self.request('append_rows')
+        for row in values:
+            self.cells.append([str(cell) for cell in row])
+        self.row_count = max(self.row_count, len(self.cells))
+
+    def append_row(self, values, value_input_option=None):
+        self.request('append_row')
+        self.cells.append([str(cell) for cell in values])
+        self.row_count = max(self.row_count, len(self.cells))
+
+    def delete_row(self, index):
+        self.request('delete_row')
+        if index <= len(self.cells):
+            del self.cells[index - 1]
+
+    def add_rows(self, rows):
+        self.request('add_rows')
+        self.row_count += rows
+
+    def add_cols(self, cols):
+        self.request('add_cols')
+        self.col_count += cols
+
+
+class FakeDiscord:
+    """Учёт и задержка исходящих запросов к Discord."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.ids = itertools.count(10 ** 17)
+
+    def reset(self):
+        self.calls.clear()
+
+    async def request(self, op):
+        self.calls[op] += 1
+        await asyncio.sleep(self.latency)
+
+    def next_id(self):
+        return next(self.ids)
+
+
+class FakeUser:
+    def __init__(self, discord, name, bot=False):
+        self.discord = discord
+        self.id = discord.next_id()
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+
+    async def send(self, content=None, **kwargs):
+        await self.discord.request('dm')
+
+
+class FakeMessage:
+    def __init__(self, discord, channel, author, content='', attachments=None):
+        self.discord = discord
+        self.id = discord.next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content or ''
+        self.attachments = attachments or []
+        self.components = []
+
+    async def add_reaction(self, emoji):
+        await self.discord.request('add_reaction')
+
+    async def edit(self, **kwargs):
+        await self.discord.request('edit_message')
+        self.content = kwargs.get('content', self.content)
+        return self
+
+    async def delete(self):
+        await self.discord.request('delete_message')
+
+
+class FakeChannel:
+    def __init__(self, discord, guild, name, category=None):
+        self.discord = discord
+        self.id = discord.next_id()
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await self.discord.request('send_message')
+        message = FakeMessage(self.discord, self, self.guild.me, content)
+        self.messages.append(message)
+        return message
+
+    async def delete(self):
+        await self.discord.request('delete_channel')
+        self.guild.remove_channel(self)
+
+
+class FakeCategory:
+    def __init__(self, name):
+        self.name = name
+        self.text_channels = []
+
+
+class FakeGuild:
+    def __init__(self, discord, bot, name='NightCrows'):
+        self.discord = discord
+        self.bot = bot
+        self.id = discord.next_id()
+        self.name = name
+        self.me = bot.user
+        self.categories = []
+        self.text_channels = []
+
+    def add_category(self, name):
+        category = FakeCategory(name)
+        self.categories.append(category)
+        return category
+
+    def add_channel(self, name, category=None):
+        """Создаёт канал без запроса - для подготовки данных."""
+        channel = FakeChannel(self.discord, self, name, category)
+        self.text_channels.append(channel)
+        if category is not None:
+            category.text_channels.append(channel)
+        self.bot.channels[channel.id] = channel
+        return channel
+
+    def remove_channel(self, channel):
+        if channel in self.text_channels:
+            self.text_channels.remove(channel)
+        if channel.category is not None and channel in channel.category.text_channels:
+            channel.category.text_channels.remove(channel)
+        self.bot.channels.pop(channel.id, None)
+
+    async def create_text_channel(self, name, category=None):
+        await self.discord.request('create_channel')
+        return self.add_channel(name, category)
+
+
+class FakeBot:
+    """То, что модули бота берут из commands.Bot: пользователь, сервера, каналы, события."""
+
+    def __init__(self, discord):
+        self.discord = discord
+        self.channels = {}
+        self.user = FakeUser(discord, 'NightCrowsBot', bot=True)
+        self.guilds = []
+        self.events = collections.Counter()
+
+    def add_guild(self, name='NightCrows'):
+        guild = FakeGuild(self.discord, self, name)
+        self.guilds.append(guild)
+        return guild
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def dispatch(self, event, *args):
+        self.events[event] += 1
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, view=None, ephemeral=False, **kwargs):
+        await self.interaction.discord.request('interaction_response')
+        self.interaction.view = view
+
+    async def edit_message(self, content=None, view=None, **kwargs):
+        await self.interaction.discord.request('interaction_response')
+
+    async def send_modal(self, modal):
+        await self.interaction.discord.request('interaction_response')
+
+
+class FakeInteraction:
+    def __init__(self, discord, user, channel):
+        self.discord = discord
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.guild_id = channel.guild.id
+        self.view = None  # View, которую бот отправил в ответ
+        self.response = FakeInteractionResponse(self)
+
+
+class FakeReaction:
+    """Полезная нагрузка on_raw_reaction_add."""
+
+    def __init__(self, message, user, emoji):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.guild_id = message.channel.guild.id
+        self.user_id = user.id
+        self.emoji = emoji
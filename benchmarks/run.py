@@ -0,0 +1,306 @@
+"""Замеры бота без сети: python -m benchmarks.run --marks 1000 --boss-rows 10000
+
+Google Sheets и Discord подменяются заглушками из benchmarks/fakes.py с
+настраиваемой задержкой и квотой. Для каждого сценария печатаются время,
+количество запросов к API и время, на которое блокировался цикл событий.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Логи модулей бота глушим до их импорта: data.py настраивает logging при загрузке
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+import arena  # noqa: E402
+import data  # noqa: E402
+import Gears  # noqa: E402
+import guilds  # noqa: E402
+import journal  # noqa: E402
+import mirror  # noqa: E402
+import respawn  # noqa: E402
+import sessions  # noqa: E402
+import sheets  # noqa: E402
+import spawn  # noqa: E402
+import wizard  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+
+TIME_FORMAT = "%d.%m.%Y %H:%M"
+
+
+class LoopMonitor:
+    """Замечает, насколько позже положенного просыпается короткий sleep."""
+
+    def __init__(self, interval=0.005, threshold=0.002):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.longest = 0.0
+        self.task = None
+
+    def reset(self):
+        self.blocked = 0.0
+        self.longest = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started - self.interval
+            if lag > self.threshold:
+                self.blocked += lag
+                self.longest = max(self.longest, lag)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.google = fakes.FakeGoogle(latency=args.sheets_latency, quota=args.quota)
+        self.discord = fakes.FakeDiscord(latency=args.discord_latency)
+        self.bot = fakes.FakeBot(self.discord)
+        self.guild = self.bot.add_guild()
+        self.monitor = LoopMonitor()
+        self.results = []
+        self.players = [f"Player{index}" for index in range(args.players)]
+
+    def install(self, workdir):
+        """Подключает модули бота к заглушкам и временным файлам."""
+        sheets.client = self.google
+        sheets.gateway = sheets.SheetsGateway(requests_per_minute=self.args.quota)
+        sheets.handles = sheets.HandleCache()
+        journal.journal.path = os.path.join(workdir, journal.JOURNAL_FILE)
+        mirror.mirror.path = os.path.join(workdir, mirror.MIRROR_FILE)
+        wizard.store.path = os.path.join(workdir, wizard.WIZARD_FILE)
+        respawn.history.path = os.path.join(workdir, respawn.HISTORY_FILE)
+        for module in (arena, Gears, spawn):
+            module.bot = self.bot
+        data.kill_listeners.append(lambda spreadsheet, rows: self.bot.dispatch('boss_kill', spreadsheet, rows))
+
+        # Без guilds.json сервер работает с настройками по умолчанию
+        config = guilds.get(self.guild.id)
+        category = self.guild.add_category(config.category)
+        self.guild.add_channel(config.alert_channel, category)
+        self.guild.add_channel(config.arena_channel)
+        self.progress_channel = self.guild.add_channel(config.progress_channel)
+        Gears.route_progress_channel(self.guild)
+        self.spawns = spawn.get_state(self.guild.id)
+
+        spreadsheet = self.google.create(sheets.SPREADSHEET_NAME)
+        now = datetime.datetime.now()
+        # Лист прошлой недели со всеми игроками: лист текущей бот создаст сам по его списку
+        last_week = data.week_start(now) - datetime.timedelta(days=7)
+        dates = [(last_week + datetime.timedelta(days=day)).strftime(data.DATE_FORMAT) for day in range(7)]
+        spreadsheet.add(data.week_title(last_week), [['Ник'] + dates] + [[player] for player in self.players])
+        spreadsheet.add(Gears.GEARSCORE_SHEET, [['Ник']] + [
+            [player, '50', '10 000', '', '500', '', '300', '', '200', '', '', ''] for player in self.players])
+
+        bosses = list(spawn.boss_spawn_times)
+        boss_rows = [['Босс', 'Время', 'Зона', 'Сложность', 'Канал', 'Появился', 'Тайм', 'ID']]
+        for _ in range(self.args.boss_rows):
+            killed = now - datetime.timedelta(minutes=random.randint(0, 14 * 60))
+            boss_rows.append([random.choice(bosses), killed.strftime(TIME_FORMAT), str(random.randint(1, 9)),
+                              random.choice(['Обычный', 'Хаос']), random.choice(['Канал 1', 'Канал 2']), '', '',
+                              data.new_kill_id()])
+        spreadsheet.add(data.BOSS_SHEET, boss_rows)
+
+    async def measure(self, name, scenario):
+        self.google.reset()
+        self.discord.reset()
+        self.monitor.reset()
+        started = time.perf_counter()
+        extra = await scenario()
+        wall = time.perf_counter() - started
+
+        sheets_calls = {}
+        for (op, _), count in self.google.calls.items():
+            sheets_calls[op] = sheets_calls.get(op, 0) + count
+        self.results.append({
+            'scenario': name,
+            'wall_s': round(wall, 3),
+            'sheets_calls': sum(sheets_calls.values()),
+            'sheets_by_op': sheets_calls,
+            'sheets_429': self.google.rejected,
+            'discord_calls': sum(self.discord.calls.values()),
+            'discord_by_op': dict(self.discord.calls),
+            'loop_blocked_ms': round(self.monitor.blocked * 1000, 1),
+            'loop_longest_ms': round(self.monitor.longest * 1000, 1),
+            **(extra or {}),
+        })
+
+    async def flush(self, kind):
+        while journal.pending_count(kind):
+            _, failed = await journal.journal.flush(kind)
+            if failed:
+                logging.warning("Не выгружено записей (%s): %d", kind, failed)
+                return
+
+    async def bench_marks(self):
+        now = datetime.datetime.now()
+        for index in range(self.args.marks):
+            mark_day = now - datetime.timedelta(days=index % 7)
+            await data.record_mark(self.players[index % len(self.players)], mark_day.strftime("%d.%m.%Y"),
+                                   self.spawns.config.spreadsheet)
+        await self.flush('mark')
+
+    async def bench_kills(self):
+        kill_time = datetime.datetime.now().strftime(TIME_FORMAT)
+        for _ in range(self.args.kills):
+            await data.record_boss_kill("Kiaron", kill_time, "5", "Обычный", "Канал 1", self.spawns.config.spreadsheet)
+        await self.flush('kill')
+
+    async def bench_progress(self):
+        for index in range(self.args.progress):
+            await Gears.record_progress(self.players[index % len(self.players)], '51', '10 500', '510', '305', '205',
+                                        'https://example.com/gear.png', self.spawns.config.spreadsheet)
+        await self.flush('progress')
+
+    async def bench_boss_cache(self):
+        self.spawns.syncs_since_full = spawn.FULL_SYNC_EVERY
+        await self.spawns.update_boss_cache(force=True)  # Полная синхронизация
+        await self.spawns.update_boss_cache(force=True)  # Хвост листа
+
+    async def bench_spawn_alerts(self):
+        now = datetime.datetime.now()
+        upcoming = sorted((boss for boss in self.spawns.boss_cache.values() if boss.spawn_time > now),
+                          key=lambda boss: boss.spawn_time)[:self.args.alerts]
+        channel = discord_channel(self.guild, self.spawns.config.alert_channel)
+        for boss in upcoming:
+            await self.spawns.send_spawn_alert(boss)
+        for message in channel.messages[len(channel.messages) - len(upcoming):]:
+            await self.spawns.on_raw_reaction_add(fakes.FakeReaction(message, fakes.FakeUser(self.discord, 'Scout'), "👍"))
+        await self.flush('archive')
+
+    async def bench_respawn(self):
+        # История подтверждений: загрузка с диска, полный пересчёт окон и поштучные подтверждения
+        now = datetime.datetime.now()
+        rows = []
+        for _ in range(self.args.history):
+            boss = random.choice(list(spawn.boss_spawn_times))
+            killed = now - datetime.timedelta(minutes=random.randint(60, 90 * 24 * 60))
+            appeared = killed + datetime.timedelta(minutes=spawn.boss_spawn_times[boss] + random.gauss(0, 15))
+            rows.append((boss, random.choice(['Обычный', 'Хаос']), random.choice(['Канал 1', 'Канал 2']),
+                         killed.timestamp(), respawn.APPEARED, appeared.timestamp()))
+        db = respawn.history.connect()
+        with db:
+            db.execute("BEGIN")
+            db.executemany("INSERT INTO kills (boss, difficulty, channel, kill_at, outcome, appeared_at) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        respawn.load(spawn.boss_spawn_times)
+        started = time.perf_counter()
+        respawn.history.recompute()
+        recompute_ms = (time.perf_counter() - started) * 1000
+        for boss in list(spawn.boss_spawn_times):
+            killed = now - datetime.timedelta(minutes=spawn.boss_spawn_times[boss])
+            respawn.add(boss, 'Обычный', 'Канал 1', killed, respawn.APPEARED, now)
+            self.spawns.refresh_predictions(boss)
+        return {'recompute_ms': round(recompute_ms, 1)}
+
+    async def bench_arena(self):
+        channel = discord_channel(self.guild, guilds.get(self.guild.id).arena_channel)
+        panel = arena.KillReportPanel()
+        for index in range(self.args.reports):
+            user = fakes.FakeUser(self.discord, self.players[index % len(self.players)])
+            interaction = fakes.FakeInteraction(self.discord, user, channel)
+            await panel.report.callback(interaction)
+            view = interaction.view
+            view.difficulty_level, view.selected_channel_number, view.boss_name = "Обычный", "Канал 1", "Grish"
+            await view.submit(interaction, "7")
+        await self.flush('kill')
+
+    async def bench_progress_wizard(self):
+        for index in range(self.args.wizards):
+            user = fakes.FakeUser(self.discord, f"Wizard{index}")
+            await Gears.on_message(fakes.FakeMessage(self.discord, self.progress_channel, user, "!"))
+            session = sessions.get('progress', user.id)
+            channel = self.bot.get_channel(session.channel_id)
+            await Gears.on_message(fakes.FakeMessage(self.discord, channel, user, "https://example.com/gear.png"))
+            await Gears.on_message(fakes.FakeMessage(self.discord, channel, user, "60, 1000, 800, 500, 12 345"))
+        await self.flush('progress')
+
+    async def run(self):
+        self.monitor.start()
+        scenarios = [
+            ('marks', self.bench_marks),
+            ('kills', self.bench_kills),
+            ('progress', self.bench_progress),
+            ('boss_cache', self.bench_boss_cache),
+            ('spawn_alerts', self.bench_spawn_alerts),
+            ('respawn', self.bench_respawn),
+            ('arena', self.bench_arena),
+            ('progress_wizard', self.bench_progress_wizard),
+        ]
+        for name, scenario in scenarios:
+            if self.args.only and name not in self.args.only:
+                continue
+            await self.measure(name, scenario)
+        self.monitor.task.cancel()
+
+
+def discord_channel(guild, name):
+    return next(channel for channel in guild.text_channels if channel.name == name)
+
+
+def print_table(results):
+    header = f"{'сценарий':<16}{'время, с':>10}{'Sheets':>8}{'429':>6}{'Discord':>9}{'блок, мс':>10}{'макс, мс':>10}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result['scenario']:<16}{result['wall_s']:>10.2f}{result['sheets_calls']:>8}{result['sheets_429']:>6}"
+              f"{result['discord_calls']:>9}{result['loop_blocked_ms']:>10.1f}{result['loop_longest_ms']:>10.1f}")
+    print()
+    for result in results:
+        if result['sheets_by_op']:
+            calls = ', '.join(f"{op}={count}" for op, count in sorted(result['sheets_by_op'].items()))
+            print(f"{result['scenario']}: {calls}")
+        if 'recompute_ms' in result:
+            print(f"{result['scenario']}: пересчёт окон {result['recompute_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры бота на заглушках Google Sheets и Discord")
+    parser.add_argument('--marks', type=int, default=1000, help="сколько отметок выгрузить")
+    parser.add_argument('--players', type=int, default=100, help="сколько игроков на листах")
+    parser.add_argument('--boss-rows', type=int, default=10000, help="сколько строк в листе Boss")
+    parser.add_argument('--kills', type=int, default=100, help="сколько убийств записать")
+    parser.add_argument('--progress', type=int, default=100, help="сколько записей прогресса выгрузить")
+    parser.add_argument('--alerts', type=int, default=20, help="сколько уведомлений о спавне отправить")
+    parser.add_argument('--history', type=int, default=50000, help="сколько убийств в истории появлений")
+    parser.add_argument('--reports', type=int, default=50, help="сколько отчётов через форму arena")
+    parser.add_argument('--wizards', type=int, default=20, help="сколько мастеров прогресса пройти")
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="задержка запроса к Sheets, с")
+    parser.add_argument('--discord-latency', type=float, default=0.05, help="задержка запроса к Discord, с")
+    parser.add_argument('--quota', type=int, default=60, help="квота Sheets, запросов в минуту")
+    parser.add_argument('--only', nargs='*', help="запустить только эти сценарии")
+    parser.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    bench = Bench(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        bench.install(workdir)
+        asyncio.run(bench.run())
+        # Файлы SQLite закрываем до удаления временного каталога
+        for store in (journal.journal, mirror.mirror, wizard.store, respawn.history):
+            if store.db is not None:
+                store.db.close()
+
+    if args.json:
+        json.dump(bench.results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_table(bench.results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,410 @@
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import logging
 import datetime
 import asyncio
+import collections
+import uuid
+import guilds
+import journal
+import mirror
+import sheets
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-client = gspread.authorize(creds)
+# Сколько ячеек отправлять одним batch_update
+MARKS_BATCH_CHUNK = 200
+# Сколько секунд копим отметки в журнале перед выгрузкой
+MARKS_FLUSH_DELAY = 61
 
-marks_buffer = []
-committing = False
+# Вызываются с названием таблицы и списком строк после записи убийств в её лист Boss
+kill_listeners = []
 
+# Лист отметок заводится на каждую неделю (с понедельника) заранее: все даты
+# недели и известные ники уже на месте, поэтому выгрузка отметок не тратит
+# запросы на поиск и создание строк и столбцов
+WEEK_TITLE = "Неделя {week} ({year})"
+DATE_FORMAT = "%d.%m.%Y"
+WEEK_SPARE_ROWS = 50  # Запас пустых строк под новых игроков
+WEEK_PREPARE_AHEAD = datetime.timedelta(hours=6)  # За сколько до начала недели создаём её лист
+BOSS_SHEET = "Boss"
+# Столбцы листа Boss: босс, время, зона, сложность, канал, появился, тайм, id убийства.
+# По id строку находят при переносе в архив, даже если строки выше уже удалили
+KILL_ID_COLUMN = 8
 
-async def initialize_sheets():
-    week_sheets = [ws.title for ws in client.open("NightCrowsApp").worksheets()]
-    logging.info(f"Доступные листы с неделями: {week_sheets}")
-
+weeks = {}  # (таблица, понедельник) -> WeekLayout
+week_lock = asyncio.Lock()
+week_task = None
 
-async def record_mark(nickname, mark_time):
-    global marks_buffer, committing
-    marks_buffer.append((str(nickname), str(mark_time)))
-    logging.info(f"Записанные отметки в буфер: {marks_buffer}")
-
-    if marks_buffer and not committing:
-        committing = True
-        asyncio.create_task(commit_marks_after_delay())
 
+async def initialize_sheets():
+    spreadsheet = await sheets.handles.spreadsheet()
+    week_sheets = [ws.title for ws in await sheets.call(spreadsheet.worksheets)]
+    logging.info(f"Доступные листы с неделями: {week_sheets}")
 
-async def commit_marks_after_delay():
-    await asyncio.sleep(61)
-    await commit_marks_data()
 
+async def record_mark(nickname, mark_time, spreadsheet):
+    # Отметка сохраняется в локальный журнал и переживёт перезапуск; в таблицу её выгрузит фоновая задача
+    journal.append('mark', {'spreadsheet': spreadsheet, 'row': [str(nickname), str(mark_time)]})
+    logging.info(f"Отметка {nickname} за {mark_time} записана в журнал, ожидают выгрузки: {journal.pending_count('mark')}")
 
-async def commit_marks_data():
-    """Коммитит данные из буфера в Google Sheets."""
-    global marks_buffer, committing
 
-    if not marks_buffer:
+async def commit_marks_data(entries):
+    """Коммитит отметки из журнала в Google Sheets. Возвращает id неотправленных записей."""
+    if not entries:
         logging.info("Буфер пуст, ничего не коммитим.")
-        committing = False
-        return
-
-    logging.info("Начинаем коммит отметок...")
-
+        return []
+
+    failed = []
+    for spreadsheet, group in by_spreadsheet(entries).items():
+        failed.extend(await commit_marks(spreadsheet, group))
+    return failed
+
+
+async def commit_marks(spreadsheet, entries):
+    """Коммитит отметки одной таблицы. Возвращает id неотправленных записей."""
+    logging.info(f"Начинаем коммит отметок в {spreadsheet}...")
+
+    pending, entry_ids = coalesce_marks(entries)
+    failed = collections.Counter()
+
+    # Отметки раскладываем по неделям: в начале недели в журнале могут остаться отметки прошлой
+    by_week = collections.defaultdict(list)
+    for key in pending:
+        by_week[week_start(parse_mark_date(key[1]) or datetime.date.today())].append(key)
+
+    for monday, keys in by_week.items():
+        # Ошибка одной недели не должна возвращать в журнал отметки, уже записанные в другую
+        try:
+            layout = await get_week_layout(spreadsheet, monday)
+            if layout is None:
+                logging.error(f"Не удалось получить лист отметок недели с {monday:%d.%m.%Y}.")
+                for key in keys:
+                    failed[key] += pending[key]
+                continue
+            week_failed = await write_marks(layout, {key: pending[key] for key in keys})
+        except Exception as e:
+            logging.error(f"Ошибка при коммите отметок недели с {monday:%d.%m.%Y}: {e}")
+            # Раскладка в памяти могла разойтись с листом: в следующий раз перечитаем её
+            weeks.pop((spreadsheet, monday), None)
+            week_failed = {key: pending[key] for key in keys}
+        for key, count in week_failed.items():
+            failed[key] += count
+
+    logging.info(f"Отметки: {sum(pending.values())} шт. в {len(pending)} ячейках, "
+                 f"не отправлено: {sum(failed.values())}")
+    if failed:
+        logging.info("Некоторые данные не были отправлены и останутся в журнале для повторной отправки.")
+    else:
+        logging.info("Все данные успешно коммитятся в таблицу.")
+
+    # Неотправленные отметки остаются в журнале, журнал повторит их позже
+    return [entry_id for key in failed for entry_id in entry_ids[key]]
+
+
+async def write_marks(layout, pending):
+    """Пишет отметки одной недели пачками batch_update. Возвращает неотправленные отметки."""
+    failed = collections.Counter()
+    groups = []
+    for (nickname, mark_time), count in pending.items():
+        row_index, date_index, cells = layout.cell(nickname, mark_time)
+        new_value = layout.counts.get((row_index, date_index), 0) + count
+        logging.info(f"Обновляем {nickname}: {new_value - count} -> {new_value} для даты {mark_time}")
+        # Новый ник или дата уходят в той же пачке, что и сама отметка: отдельных запросов на раскладку нет
+        cells.append({'range': gspread.utils.rowcol_to_a1(row_index, date_index), 'values': [[new_value]]})
+        groups.append((cells, (nickname, mark_time), count, (row_index, date_index), new_value))
+
+    worksheet = layout.worksheet
+    if layout.next_row - 1 > worksheet.row_count:
+        # Запас строк кончился: редкий случай, когда лист всё же приходится растить
+        await sheets.call(worksheet.add_rows, layout.next_row - 1 - worksheet.row_count + WEEK_SPARE_ROWS,
+                          priority=sheets.PRIORITY_LOW)
+    if layout.next_col - 1 > worksheet.col_count:
+        await sheets.call(worksheet.add_cols, layout.next_col - 1 - worksheet.col_count, priority=sheets.PRIORITY_LOW)
+
+    # Ячейки одной отметки (вместе с новым ником или датой) не разрываем между пачками
+    chunks, size = [[]], 0
+    for group in groups:
+        if chunks[-1] and size + len(group[0]) > MARKS_BATCH_CHUNK:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(group)
+        size += len(group[0])
+
+    for chunk in chunks:
+        updates = [cell for cells, _, _, _, _ in chunk for cell in cells]
+        try:
+            await sheets.call(worksheet.batch_update, updates, value_input_option='USER_ENTERED',
+                              priority=sheets.PRIORITY_LOW)
+        except Exception as e:
+            logging.error(f"Ошибка при коммите данных: {e}")
+            # Раскладка в памяти могла разойтись с листом: в следующий раз перечитаем её
+            weeks.pop((layout.spreadsheet, layout.monday), None)
+            # Повторно отправим только ячейки из неудавшейся пачки
+            for _, key, count, _, _ in chunk:
+                failed[key] += count
+            continue
+        mirror_updates(layout.sheet, updates)
+        for _, _, _, cell, value in chunk:
+            layout.counts[cell] = value
+    return failed
+
+
+def mirror_updates(sheet, updates):
+    """Переносит записанные в лист ячейки в локальную копию."""
+    mirror.update_cells(sheet, [gspread.utils.a1_to_rowcol(update['range']) + (update['values'][0][0],)
+                                for update in updates])
+
+
+def coalesce_marks(entries):
+    """Сворачивает записи журнала (id, [ник, дата]) в приращения по ячейкам.
+
+    Возвращает счётчик отметок по ячейкам и id записей журнала для каждой ячейки.
+    """
+    pending = collections.Counter()
+    entry_ids = collections.defaultdict(list)
+    for entry_id, (nickname, mark_time) in entries:
+        mark_time = str(mark_time).strip()
+        # Отметка со временем попадает в столбец своей даты
+        day = parse_mark_date(mark_time)
+        key = (str(nickname), day.strftime(DATE_FORMAT) if day else mark_time)
+        pending[key] += 1
+        entry_ids[key].append(entry_id)
+    return pending, entry_ids
+
+
+class WeekLayout:
+    """Раскладка листа недели в памяти: ник -> строка, дата -> столбец и текущие значения."""
+
+    def __init__(self, spreadsheet, title, monday, worksheet, values):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.sheet = mirror.sheet_key(title, spreadsheet)  # Ключ локальной копии листа
+        self.monday = monday
+        self.worksheet = worksheet
+        header = [cell.strip() for cell in values[0]] if values else []
+        self.rows = {}
+        for index, row in enumerate(values[1:], start=2):
+            if row and row[0] and row[0] not in self.rows:
+                self.rows[row[0]] = index
+        self.cols = {}
+        for index, cell in enumerate(header[1:], start=2):
+            if cell and cell not in self.cols:
+                self.cols[cell] = index
+        self.counts = {}
+        for row_index, row in enumerate(values[1:], start=2):
+            for col_index, cell in enumerate(row[1:], start=2):
+                if cell and cell.isdigit():
+                    self.counts[(row_index, col_index)] = int(cell)
+        # Первая свободная строка - после последней с ником, а не после запаса пустых строк
+        self.next_row = max(self.rows.values(), default=1) + 1
+        self.next_col = max(len(header), 1) + 1
+
+    def cell(self, nickname, mark_time):
+        """Строка и столбец отметки; для нового ника или даты - ещё и ячейки, которые их создают."""
+        cells = []
+        if nickname not in self.rows:
+            self.rows[nickname] = self.next_row
+            cells.append({'range': gspread.utils.rowcol_to_a1(self.next_row, 1), 'values': [[nickname]]})
+            self.next_row += 1
+        if mark_time not in self.cols:
+            self.cols[mark_time] = self.next_col
+            cells.append({'range': gspread.utils.rowcol_to_a1(1, self.next_col), 'values': [[mark_time]]})
+            self.next_col += 1
+        return self.rows[nickname], self.cols[mark_time], cells
+
+
+def week_start(day):
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def week_title(monday):
+    year, week, _ = monday.isocalendar()
+    return WEEK_TITLE.format(week=week, year=year)
+
+
+def parse_mark_date(mark_time):
+    for fmt in (DATE_FORMAT, "%d.%m.%Y %H:%M"):
+        try:
+            return datetime.datetime.strptime(mark_time, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+async def get_week_layout(spreadsheet, monday, create=True):
+    """Раскладка листа недели: из памяти, из таблицы или вновь созданного листа.
+
+    Загруженная раскладка не перестраивается по локальной копии: снимок листа
+    может оказаться старше только что записанных отметок, и следующее
+    приращение затёрло бы их. Счётчики в памяти - главный источник для недели.
+    """
+    layout = weeks.get((spreadsheet, monday))
+    if layout is not None:
+        return layout
+    async with week_lock:
+        return await load_week_layout(spreadsheet, monday, create)
+
+
+async def load_week_layout(spreadsheet, monday, create):
+    layout = weeks.get((spreadsheet, monday))
+    if layout is not None:
+        return layout
+
+    title = week_title(monday)
     try:
-        worksheet = await get_week_sheet(4)
-        if worksheet is None:
-            logging.error("Не удалось получить рабочий лист для недели 4.")
-            committing = False
-            return
-
-        # Сохраняем ненаписанные данные в новый список
-        new_commit_buffer = []
-
-        while marks_buffer:
-            batch = marks_buffer[:3]  # Берем первую пачку из 5 записей
-            try:
-                # Асинхронная запись в Google Sheets
-                for nickname, mark_time in batch:
-                    row_index = find_or_create_nickname_row(worksheet, nickname)
-                    date_index = find_or_create_date_column(worksheet, mark_time)
-
-                    current_value = worksheet.cell(row_index, date_index).value
-                    current_value = int(current_value) if current_value and current_value.isdigit() else 0
-
-                    logging.info(f"Обновляем {nickname}: текущее значение {current_value} для даты {mark_time}")
-
-                    new_value = current_value + 1
-                    await asyncio.get_event_loop().run_in_executor(None, worksheet.update_cell, row_index, date_index,
-                                                                   new_value)
-
-                    logging.info(
-                        f"Обновлено значение для {nickname} в столбце {mark_time}: {current_value} -> {new_value}")
+        worksheet = await sheets.get_worksheet(title, spreadsheet, priority=sheets.PRIORITY_LOW)
+    except gspread.exceptions.WorksheetNotFound:
+        if not create:
+            return None
+        layout = await create_week_sheet(spreadsheet, monday)
+    except Exception as e:
+        logging.error("Ошибка при получении листа %s: %s", title, e)
+        return None
+    else:
+        # Лист уже есть (например, после перезапуска): раскладку читаем из самой таблицы,
+        # а не из копии - выгрузки отметок идут по одной, так что все прежние уже в листе
+        values = await sheets.call(worksheet.get_all_values, priority=sheets.PRIORITY_LOW)
+        mirror.replace(mirror.sheet_key(title, spreadsheet), values)
+        layout = WeekLayout(spreadsheet, title, monday, worksheet, values)
 
-            except Exception as e:
-                logging.error(f"Ошибка при коммите данных: {e}")
-                # Если произошла ошибка, добавляем записи обратно в new_commit_buffer
-                new_commit_buffer.extend(batch)
-                # Добавляем задержку перед следующей попыткой
-                await asyncio.sleep(61)  # Увеличиваем задержку до 61 секунд
+    weeks[(spreadsheet, monday)] = layout
+    return layout
 
-            # Успешно обновляем записи, поэтому их можно удалить
-            marks_buffer = marks_buffer[3:]  # Удаляем обработанные записи
 
-        # Обновляем основной буфер с теми, которые остались не отправленными
-        marks_buffer = new_commit_buffer
+async def create_week_sheet(spreadsheet, monday):
+    """Создаёт лист недели со всеми датами и ником каждого игрока прошлой недели."""
+    title = week_title(monday)
+    try:
+        previous = await load_week_layout(spreadsheet, monday - datetime.timedelta(days=7), create=False)
+    except Exception as e:
+        logging.error("Не удалось прочитать прошлую неделю для листа %s: %s", title, e)
+        previous = None
+    roster = sorted(previous.rows, key=previous.rows.get) if previous is not None else []
+
+    header = ['Ник'] + [(monday + datetime.timedelta(days=day)).strftime(DATE_FORMAT) for day in range(7)]
+    handle = await sheets.handles.spreadsheet(spreadsheet, priority=sheets.PRIORITY_LOW)
+    worksheet = await sheets.call(handle.add_worksheet, title=title, rows=len(roster) + WEEK_SPARE_ROWS + 1,
+                                  cols=len(header), priority=sheets.PRIORITY_LOW)
+    updates = [{'range': 'A1', 'values': [header]}]
+    if roster:
+        updates.append({'range': 'A2', 'values': [[nickname] for nickname in roster]})
+    await sheets.call(worksheet.batch_update, updates, value_input_option='USER_ENTERED', priority=sheets.PRIORITY_LOW)
+
+    values = [header] + [[nickname] for nickname in roster]
+    mirror.replace(mirror.sheet_key(title, spreadsheet), values)
+    logging.info("Создан лист %s в таблице %s: %d игроков", title, spreadsheet, len(roster))
+    return WeekLayout(spreadsheet, title, monday, worksheet, values)
+
+
+async def week_rollover():
+    """Держит готовыми листы текущей и следующей недели и забывает старые."""
+    while True:
+        today = week_start(datetime.date.today())
+        for key in list(weeks):
+            if key[1] < today - datetime.timedelta(days=7):
+                # Отметки прошлой недели ещё могут прийти из журнала, более старые - нет
+                weeks.pop(key)
+
+        now = datetime.datetime.now()
+        next_monday = datetime.datetime.combine(today + datetime.timedelta(days=7), datetime.time())
+        prepare_at = next_monday - WEEK_PREPARE_AHEAD
+        try:
+            # Лист недели готовим в таблице каждого сервера
+            for spreadsheet in guilds.spreadsheets():
+                await get_week_layout(spreadsheet, today)
+                if now >= prepare_at:
+                    await get_week_layout(spreadsheet, next_monday.date())
+        except Exception as e:
+            logging.error("Ошибка при подготовке листа недели: %s", e)
+            await asyncio.sleep(60)
+            continue
+
+        wake_at = prepare_at if now < prepare_at else next_monday
+        await asyncio.sleep(max((wake_at - datetime.datetime.now()).total_seconds(), 1))
+
+
+def start_week_rollover():
+    global week_task
+    if week_task is None:
+        week_task = asyncio.create_task(week_rollover())
+    return week_task
+
+
+async def record_boss_kill(boss_name, kill_time_str, zone, difficulty_level, selected_channel_number, spreadsheet):
+    try:
+        kill_time = datetime.datetime.strptime(kill_time_str, "%d.%m.%Y %H:%M")
+        formatted_time = kill_time.strftime("%d.%m.%Y %H:%M")
 
-        if new_commit_buffer:
-            logging.info("Некоторые данные не были отправлены и останутся в буфере для повторной отправки.")
-        else:
-            logging.info("Все данные успешно коммитятся в таблицу.")
+        logging.info(f"Попытка записи в таблицу: Босс: {boss_name}, Время: {formatted_time}, Зона: {zone}, Сложность: {difficulty_level}, Канал: {selected_channel_number}")
+        # Пользователь получает ответ сразу после записи в журнал, не дожидаясь Google
+        row = [boss_name, formatted_time, zone, difficulty_level, selected_channel_number, '', '', new_kill_id()]
+        journal.append('kill', {'spreadsheet': spreadsheet, 'row': row})
+        return True
 
     except Exception as e:
-        logging.error(f"Ошибка при коммите отметок: {e}")
-    finally:
-        committing = False  # Сбрасываем флаг после завершения коммита
-
+        logging.error(f"Ошибка при записи: {e}")
+    return False
 
-def find_or_create_nickname_row(worksheet, nickname):
-    nicknames = worksheet.col_values(1)
-    if nickname in nicknames:
-        return nicknames.index(nickname) + 1
-    else:
-        worksheet.append_row([nickname] + ['' for _ in range(worksheet.col_count - 1)])
-        return len(nicknames) + 1
 
+def new_kill_id():
+    return uuid.uuid4().hex[:12]
 
-def find_or_create_date_column(worksheet, target_date):
-    column_index = 1
-    found = False
 
-    for cell in worksheet.row_values(1):
-        if cell.strip() == target_date:
-            found = True
-            break
-        column_index += 1
+def by_spreadsheet(entries):
+    """Раскладывает записи журнала {"spreadsheet", "row"} по таблицам серверов.
 
-    if not found:
-        worksheet.update_cell(1, column_index, target_date)
+    Записи старого вида (просто строка) относятся к основной таблице.
+    """
+    groups = collections.defaultdict(list)
+    for entry_id, payload in entries:
+        if isinstance(payload, dict):
+            groups[payload['spreadsheet']].append((entry_id, payload['row']))
+        else:
+            groups[sheets.SPREADSHEET_NAME].append((entry_id, payload))
+    return groups
 
-    return column_index
 
+async def commit_boss_kills(entries):
+    """Дописывает убийства из журнала в лист Boss каждой таблицы одним запросом."""
+    failed = []
+    for spreadsheet, group in by_spreadsheet(entries).items():
+        worksheet = await get_boss_worksheet(spreadsheet)
+        if worksheet is None:
+            failed.extend(entry_id for entry_id, _ in group)
+            continue
 
-async def record_boss_kill(boss_name, kill_time_str, zone, difficulty_level, selected_channel_number):
-    try:
-        kill_time = datetime.datetime.strptime(kill_time_str, "%d.%m.%Y %H:%M")
-        formatted_time = kill_time.strftime("%d.%m.%Y %H:%M")
+        rows = [row for _, row in group]
+        try:
+            # Запись убийства важнее фоновых выгрузок отметок
+            await sheets.call(worksheet.append_rows, rows, priority=sheets.PRIORITY_HIGH)
+        except Exception as e:
+            logging.error(f"Ошибка при записи: {e}")
+            failed.extend(entry_id for entry_id, _ in group)
+            continue
 
-        logging.info(f"Попытка записи в таблицу: Босс: {boss_name}, Время: {formatted_time}, Зона: {zone}, Сложность: {difficulty_level}, Канал: {selected_channel_number}")
-        worksheet = await get_boss_worksheet()
+        mirror.append_rows(mirror.sheet_key(BOSS_SHEET, spreadsheet), rows)
+        logging.info(f"Данные о убийстве босса успешно записаны в {spreadsheet}: {len(rows)} шт.")
+        for listener in kill_listeners:
+            listener(spreadsheet, rows)
+    return failed
 
-        if worksheet:
-            worksheet.append_row([boss_name, formatted_time, zone, difficulty_level, selected_channel_number])
-            logging.info("Данные о убийстве босса успешно записаны.")
 
-    except Exception as e:
-        logging.error(f"Ошибка при записи: {e}")
+async def get_week_sheet(spreadsheet, day=None):
+    """Лист недели, в которую попадает день (по умолчанию - текущей)."""
+    layout = await get_week_layout(spreadsheet, week_start(day or datetime.date.today()))
+    return layout.worksheet if layout is not None else None
 
 
-async def get_week_sheet(week_number):
+async def get_boss_worksheet(spreadsheet):
     try:
-        return client.open("NightCrowsApp").worksheet("Неделя 4")
+        worksheet = await sheets.get_worksheet(BOSS_SHEET, spreadsheet, priority=sheets.PRIORITY_HIGH)
+        return worksheet
     except Exception as e:
-        logging.error("Ошибка при получении рабочего листа недели %d: %s", week_number, e)
+        logging.error("Ошибка при получении рабочего листа Boss таблицы %s: %s", spreadsheet, e)
         return None
 
 
-async def get_boss_worksheet():
-    try:
-        worksheet = client.open("NightCrowsApp").worksheet("Boss")
-        return worksheet
-    except Exception as e:
-        logging.error("Ошибка при получении рабочего листа Boss: %s", e)
-        return None
\ No newline at end of file
+journal.register('mark', commit_marks_data, delay=MARKS_FLUSH_DELAY)
+journal.register('kill', commit_boss_kills)
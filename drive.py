@@ -0,0 +1,102 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import logging
+import sqlite3
+import threading
+import time
+from oauth2client.service_account import ServiceAccountCredentials
+from googleapiclient.discovery import build
+from googleapiclient.http import MediaIoBaseUpload
+
+# Загрузка скриншотов на Google Drive: байты вложения берём прямо из памяти,
+# вызовы Drive выполняются в отдельных потоках, а одинаковые картинки
+# (по хэшу содержимого) второй раз не загружаются
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+CREDENTIALS_FILE = 'credentials.json'
+UPLOADS_FILE = 'uploads.sqlite3'
+MAX_WORKERS = 2
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024  # Файлы больше этого грузим по частям, байты
+CHUNK_SIZE = 1024 * 1024
+
+credentials = None
+local = threading.local()  # Клиент Drive на httplib2 не потокобезопасен: у каждого потока свой
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='drive')
+in_flight = {}  # хэш -> future загрузки, которая уже идёт
+db = None
+
+
+def get_service():
+    """Клиент Drive текущего потока, создаётся один раз."""
+    global credentials
+    service = getattr(local, 'service', None)
+    if service is None:
+        if credentials is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPES)
+        service = build('drive', 'v3', credentials=credentials, cache_discovery=False)
+        local.service = service
+    return service
+
+
+def connect():
+    global db
+    if db is None:
+        db = sqlite3.connect(UPLOADS_FILE, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS uploads (
+            sha256 TEXT PRIMARY KEY,
+            link TEXT NOT NULL,
+            uploaded REAL NOT NULL
+        )""")
+    return db
+
+
+def upload_bytes(data, filename, mimetype):
+    """Блокирующая загрузка, выполняется в пуле потоков."""
+    drive_service = get_service()
+
+    # Создание метаданных для файла
+    file_metadata = {'name': filename, 'mimeType': mimetype}
+    resumable = len(data) > RESUMABLE_THRESHOLD
+    media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mimetype, chunksize=CHUNK_SIZE, resumable=resumable)
+    request = drive_service.files().create(body=file_metadata, media_body=media, fields='id')
+    if resumable:
+        # Большой файл уходит частями: обрыв связи не заставляет начинать сначала
+        file = None
+        while file is None:
+            _, file = request.next_chunk(num_retries=3)
+    else:
+        file = request.execute(num_retries=3)
+
+    # Получаем ID загруженного файла
+    file_id = file.get('id')
+    drive_service.permissions().create(fileId=file_id, body={'role': 'reader', 'type': 'anyone'}).execute(num_retries=3)
+
+    # Возвращаем прямую ссылку на файл
+    return f'https://drive.google.com/uc?id={file_id}'
+
+
+async def upload_image(data, filename, mimetype=None):
+    """Загружает картинку на Drive и возвращает прямую ссылку; повторы отдаются из кэша."""
+    digest = hashlib.sha256(data).hexdigest()
+    row = connect().execute("SELECT link FROM uploads WHERE sha256 = ?", (digest,)).fetchone()
+    if row:
+        logging.info("Изображение %s уже загружалось, используем прежнюю ссылку", filename)
+        return row[0]
+
+    # Тот же файл, присланный дважды подряд, загружаем один раз
+    future = in_flight.get(digest)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, upload_bytes, data, filename, mimetype or 'image/jpeg')
+        in_flight[digest] = future
+        try:
+            link = await future
+        finally:
+            del in_flight[digest]
+        connect().execute("INSERT OR REPLACE INTO uploads (sha256, link, uploaded) VALUES (?, ?, ?)",
+                          (digest, link, time.time()))
+        logging.info("Изображение %s загружено на Google Drive (%d байт)", filename, len(data))
+        return link
+    return await asyncio.shield(future)
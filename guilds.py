@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import sheets
+
+# Настройки серверов Discord: таблица Google, категория и каналы бота. Файл
+# читается один раз при запуске, дальше настройки ищутся по id сервера. Без
+# файла все серверы работают с настройками по умолчанию, как один сервер раньше.
+# В файле таблица у каждого сервера своя и обязательна: сервер без неё не
+# обслуживается, чтобы его данные не попали в чужую таблицу.
+GUILDS_FILE = os.getenv('GUILDS_FILE', 'guilds.json')
+LEGACY_SPAWN_CHANNEL_ID = 1278955149208846356  # Канал !s единственного сервера до guilds.json
+
+
+class GuildConfig:
+    """Настройки одного сервера; незаданные поля берутся из DEFAULTS."""
+
+    DEFAULTS = {
+        'spreadsheet': None,  # Таблица с листами Boss, Boss архив, GearScore и неделями отметок
+        'category': 'Бот',  # Категория каналов бота
+        'alert_channel': 'alert_arena',  # Канал уведомлений о спавне внутри категории
+        'spawn_channel_id': None,  # Где работает !s; null - в любом канале
+        'arena_channel': 'arena',  # Канал с кнопкой отчёта об убийстве
+        'progress_channel': 'прогресс',  # Канал, где начинается мастер прогресса
+    }
+
+    def __init__(self, guild_id=None, **settings):
+        unknown = set(settings) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"неизвестные настройки сервера {guild_id}: {', '.join(sorted(unknown))}")
+        self.guild_id = guild_id
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, settings.get(name, default))
+
+
+default = GuildConfig(spreadsheet=sheets.SPREADSHEET_NAME, spawn_channel_id=LEGACY_SPAWN_CHANNEL_ID)
+configs = {}  # id сервера -> GuildConfig
+
+
+def load(path=GUILDS_FILE):
+    """Читает guilds.json вида {"id сервера": {"spreadsheet": ..., ...}}."""
+    configs.clear()
+    if not os.path.exists(path):
+        logging.info("Файл %s не найден, все серверы используют настройки по умолчанию", path)
+        return configs
+    with open(path, encoding='utf-8') as file:
+        for guild_id, settings in json.load(file).items():
+            config = GuildConfig(int(guild_id), **settings)
+            if not config.spreadsheet:
+                logging.error("У сервера %s в %s не задана таблица, сервер не обслуживается", guild_id, path)
+                continue
+            configs[config.guild_id] = config
+    logging.info("Настройки серверов загружены: %d", len(configs))
+    return configs
+
+
+def get(guild_id):
+    """Настройки сервера или None, если guilds.json есть, а сервера в нём нет."""
+    if not configs:
+        return default
+    return configs.get(guild_id)
+
+
+def spreadsheets():
+    """Таблицы всех обслуживаемых серверов."""
+    if not configs:
+        return [default.spreadsheet]
+    return sorted({config.spreadsheet for config in configs.values()})
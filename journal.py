@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import metrics
+
+# Локальный журнал: записи попадают сюда до ответа пользователю и удаляются
+# только после того, как их обработчик успешно отправил данные в Google Sheets
+JOURNAL_FILE = 'journal.sqlite3'
+BATCH_SIZE = 500  # Сколько записей одного вида отдаём обработчику за раз
+RETRY_DELAY = 61  # Пауза перед повтором после ошибки, секунды
+
+
+class Journal:
+    """Журнал упреждающей записи на SQLite в режиме WAL с фоновой выгрузкой."""
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.db = None
+        self.handlers = {}  # вид записи -> {"handler", "delay", "due", "wakeup", "task"}
+        self.task = None
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            # В WAL режим NORMAL переживает падение процесса и не делает fsync на каждую запись
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS journal_kind ON journal (kind, id)")
+        return self.db
+
+    def register(self, kind, handler, delay=0):
+        """Регистрирует обработчик записей вида kind.
+
+        handler получает список (id, payload) и возвращает id записей, которые
+        отправить не удалось. delay - сколько секунд копить записи перед выгрузкой.
+        """
+        self.handlers[kind] = {"handler": handler, "delay": delay, "due": None, "wakeup": asyncio.Event(),
+                               "task": None}
+        if self.task is not None:
+            self.start_kind(kind)
+
+    def append(self, kind, payload):
+        """Сохраняет запись в журнал и планирует её выгрузку."""
+        cursor = self.connect().execute(
+            "INSERT INTO journal (kind, payload, created) VALUES (?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), time.time()))
+        self.schedule(kind)
+        return cursor.lastrowid
+
+    def schedule(self, kind, delay=None):
+        entry = self.handlers.get(kind)
+        if entry is None:
+            return
+        due = time.monotonic() + (entry["delay"] if delay is None else delay)
+        if entry["due"] is None or due < entry["due"]:
+            entry["due"] = due
+            entry["wakeup"].set()
+
+    def pending(self, kind, limit=BATCH_SIZE):
+        rows = self.connect().execute(
+            "SELECT id, payload FROM journal WHERE kind = ? ORDER BY id LIMIT ?", (kind, limit)).fetchall()
+        return [(entry_id, json.loads(payload)) for entry_id, payload in rows]
+
+    def pending_count(self, kind=None):
+        if kind is None:
+            return self.connect().execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+        return self.connect().execute("SELECT COUNT(*) FROM journal WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def acknowledge(self, ids):
+        self.connect().executemany("DELETE FROM journal WHERE id = ?", [(entry_id,) for entry_id in ids])
+
+    async def flush(self, kind):
+        """Отдаёт накопленные записи обработчику. Возвращает (отправлено, не отправлено)."""
+        entries = self.pending(kind)
+        if not entries:
+            return 0, 0
+
+        try:
+            failed = set(await self.handlers[kind]["handler"](entries) or ())
+        except Exception as e:
+            logging.error("Ошибка при выгрузке журнала (%s): %s", kind, e)
+            failed = {entry_id for entry_id, _ in entries}
+
+        done = [entry_id for entry_id, _ in entries if entry_id not in failed]
+        self.acknowledge(done)
+        return len(done), len(failed)
+
+    async def run(self):
+        # Всё, что не успели отправить до перезапуска, выгружаем сразу
+        for kind in self.handlers:
+            if self.pending_count(kind):
+                logging.info("В журнале остались неотправленные записи (%s): %d", kind, self.pending_count(kind))
+                self.schedule(kind, delay=0)
+        for kind in list(self.handlers):
+            self.start_kind(kind)
+
+    def start_kind(self, kind):
+        entry = self.handlers[kind]
+        if entry["task"] is None:
+            entry["task"] = asyncio.create_task(self.run_kind(kind))
+
+    async def run_kind(self, kind):
+        """Выгружает записи одного вида.
+
+        У каждого вида своя задача: большая пачка прогресса или отметок не
+        задерживает убийства, которые ждут выгрузки за ней.
+        """
+        entry = self.handlers[kind]
+        while True:
+            wait = None if entry["due"] is None else entry["due"] - time.monotonic()
+            if wait is None or wait > 0:
+                entry["wakeup"].clear()
+                try:
+                    await asyncio.wait_for(entry["wakeup"].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entry["due"] = None
+            sent, failed = await self.flush(kind)
+            if failed:
+                self.schedule(kind, delay=RETRY_DELAY)
+            elif sent == BATCH_SIZE:
+                self.schedule(kind, delay=0)  # Записей больше, чем влезло в одну пачку
+
+    def start(self):
+        if self.task is None:
+            self.connect()
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+
+journal = Journal()
+metrics.gauge('journal_pending', "Записей журнала, ожидающих выгрузки в Google Sheets",
+              lambda: {kind: journal.pending_count(kind) for kind in journal.handlers}, ('kind',))
+
+
+def register(kind, handler, delay=0):
+    journal.register(kind, handler, delay)
+
+
+def append(kind, payload):
+    return journal.append(kind, payload)
+
+
+def pending_count(kind=None):
+    return journal.pending_count(kind)
+
+
+def start():
+    return journal.start()
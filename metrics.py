@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import os
+from aiohttp import web
+from discord.ext import commands
+
+# Счётчики и гистограммы в памяти процесса. Их отдаёт локальный HTTP-эндпоинт
+# в текстовом формате Prometheus и админская команда !stats. Модули
+# регистрируют свои метрики сами, этот модуль о них ничего не знает.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+LAG_PROBE_INTERVAL = 1  # Как часто меряем задержку цикла событий, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry = {}  # имя метрики -> метрика, в порядке регистрации
+tasks = []
+runner = None
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # значения меток -> число
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # значения меток -> [счётчики по корзинам, сумма, количество]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][index] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', {**labels, 'le': repr(float(bound))}, cumulative
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, count
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+    def quantile(self, q, **labels):
+        """Верхняя граница корзины, в которую попадает квантиль q."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        entry = self.values.get(key)
+        if not entry or not entry[2]:
+            return None
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, entry[0]):
+            cumulative += bucket_count
+            if cumulative >= q * entry[2]:
+                return bound
+        return float('inf')
+
+
+class Gauge:
+    """Значение, которое считается в момент чтения: callback возвращает число или {метки: число}."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, callback, labels=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logging.error("Ошибка при чтении метрики %s: %s", self.name, e)
+            return
+        if isinstance(value, dict):
+            for key, item in value.items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, dict(zip(self.labels, key)), item
+        elif value is not None:
+            yield self.name, {}, value
+
+
+def register(metric):
+    # Повторная регистрация (например, при перезагрузке модуля) возвращает уже существующую метрику
+    return registry.setdefault(metric.name, metric)
+
+
+def counter(name, help, labels=()):
+    return register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    return register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name, help, callback, labels=()):
+    metric = Gauge(name, help, callback, labels)
+    registry[name] = metric  # Колбэк всегда берём самый свежий
+    return metric
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in list(registry.values()):
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            if labels:
+                label_text = ','.join(f'{label}="{escape(item)}"' for label, item in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}')
+            else:
+                lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+loop_lag = histogram('event_loop_lag_seconds', "Насколько позже положенного просыпается цикл событий")
+
+
+async def probe_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        loop_lag.observe(max(loop.time() - started - LAG_PROBE_INTERVAL, 0))
+
+
+async def start(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает замер задержки цикла и HTTP-эндпоинт /metrics."""
+    global runner
+    if not tasks:
+        tasks.append(asyncio.create_task(probe_loop_lag()))
+    if runner is not None:
+        return
+
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logging.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    except OSError as e:
+        logging.error("Не удалось открыть порт метрик %s:%d: %s", host, port, e)
+
+
+def stats_report():
+    """Короткая сводка для !stats."""
+    lines = []
+    sheets_latency = registry.get('sheets_call_seconds')
+    if sheets_latency is not None and sheets_latency.values:
+        lines.append("Google Sheets (вызовов, среднее время):")
+        by_op = {}
+        for key, (_, total, count) in sheets_latency.values.items():
+            op = key[0]
+            entry = by_op.setdefault(op, [0.0, 0])
+            entry[0] += total
+            entry[1] += count
+        for op, (total, count) in sorted(by_op.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {op}: {count}, {total / count:.2f} с")
+
+    for name, title in (('sheets_errors_total', "Ошибки Sheets"), ('discord_requests_total', "Запросы Discord"),
+                        ('discord_rate_limited_total', "429 от Discord")):
+        metric = registry.get(name)
+        if metric is not None and metric.values:
+            items = ', '.join(f"{'/'.join(key)}={int(value)}" for key, value in sorted(metric.values.items()))
+            lines.append(f"{title}: {items}")
+
+    for metric in registry.values():
+        if isinstance(metric, Gauge):
+            for _, labels, value in metric.samples():
+                suffix = f" ({', '.join(str(item) for item in labels.values())})" if labels else ''
+                value = f"{value:.1f}" if isinstance(value, float) else value
+                lines.append(f"{metric.help}{suffix}: {value}")
+
+    p95 = loop_lag.quantile(0.95)
+    if p95 is not None:
+        lines.append(f"Задержка цикла событий, p95: до {p95 * 1000:.0f} мс")
+    return "\n".join(lines) or "Метрик пока нет."
+
+
+class MetricsCog(commands.Cog):
+    """Команда !stats для администраторов."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name='stats')
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        import rest
+        report = stats_report()
+        await rest.send(ctx.channel, f"```\n{report[:1900]}\n```")
+
+    async def cog_unload(self):
+        global runner
+        for task in tasks:
+            task.cancel()
+        tasks.clear()
+        if runner is not None:
+            await runner.cleanup()
+            runner = None
+
+
+async def setup(client):
+    await client.add_cog(MetricsCog(client))
+    await start()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import sheets
+
+# Локальная копия листов Google Sheets: все чтения идут отсюда, а таблица
+# остаётся местом, куда бот пишет. Копия обновляется фоновой задачей и
+# сразу дописывается при каждой собственной записи бота.
+MIRROR_FILE = 'mirror.sqlite3'
+SYNC_INTERVAL = 10 * 60  # Как часто перечитываем листы целиком, секунды
+
+
+class Mirror:
+    """Зеркало листов на SQLite: строки хранятся по номеру и ключу из первого столбца."""
+
+    def __init__(self, path=MIRROR_FILE):
+        self.path = path
+        self.db = None
+        self.watched = []  # Ключи листов, которые синхронизирует фоновая задача
+        self.sources = {}  # ключ листа -> (таблица, название листа)
+        self.task = None
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS sheet_rows (
+                sheet TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                cells TEXT NOT NULL,
+                PRIMARY KEY (sheet, row_index)
+            )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS sheet_rows_key ON sheet_rows (sheet, key)")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS sheet_sync (
+                sheet TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            )""")
+        return self.db
+
+    def watch(self, title, spreadsheet=sheets.SPREADSHEET_NAME):
+        """Добавляет лист в синхронизацию и возвращает ключ, под которым хранится его копия."""
+        key = sheet_key(title, spreadsheet)
+        self.sources[key] = (spreadsheet, title)
+        if key not in self.watched:
+            self.watched.append(key)
+        return key
+
+    def synced_at(self, title):
+        row = self.connect().execute("SELECT synced_at FROM sheet_sync WHERE sheet = ?", (title,)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, title, max_age=2 * SYNC_INTERVAL):
+        """Есть ли у листа достаточно свежая копия, чтобы читать из неё вместо Google."""
+        synced_at = self.synced_at(title)
+        return synced_at is not None and time.time() - synced_at <= max_age
+
+    def replace(self, title, values):
+        """Заменяет копию листа значениями get_all_values()."""
+        db = self.connect()
+        with db:
+            db.execute("BEGIN")
+            db.execute("DELETE FROM sheet_rows WHERE sheet = ?", (title,))
+            db.executemany("INSERT INTO sheet_rows (sheet, row_index, key, cells) VALUES (?, ?, ?, ?)",
+                           [(title, row_index, row[0] if row else '', json.dumps(row, ensure_ascii=False))
+                            for row_index, row in enumerate(values, start=1)])
+            db.execute("INSERT OR REPLACE INTO sheet_sync (sheet, synced_at) VALUES (?, ?)", (title, time.time()))
+
+    def rows(self, title):
+        """Весь лист в виде списка строк, как get_all_values()."""
+        values = []
+        for row_index, cells in self.connect().execute(
+                "SELECT row_index, cells FROM sheet_rows WHERE sheet = ? ORDER BY row_index", (title,)):
+            # Пустые строки в середине листа не хранятся отдельно, восстанавливаем их
+            values.extend([[]] * (row_index - len(values) - 1))
+            values.append(json.loads(cells))
+        return values
+
+    def find(self, title, key):
+        """Первая строка листа с ключом key в первом столбце: (номер строки, ячейки) или None."""
+        row = self.connect().execute(
+            "SELECT row_index, cells FROM sheet_rows WHERE sheet = ? AND key = ? ORDER BY row_index LIMIT 1",
+            (title, key)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put_row(self, title, row_index, cells):
+        self.connect().execute("INSERT OR REPLACE INTO sheet_rows (sheet, row_index, key, cells) VALUES (?, ?, ?, ?)",
+                               (title, row_index, cells[0] if cells else '', json.dumps(cells, ensure_ascii=False)))
+
+    def update_cells(self, title, updates):
+        """Применяет изменения вида (строка, столбец, значение), нумерация с 1."""
+        db = self.connect()
+        with db:
+            db.execute("BEGIN")
+            for row_index, col_index, value in updates:
+                row = db.execute("SELECT cells FROM sheet_rows WHERE sheet = ? AND row_index = ?",
+                                 (title, row_index)).fetchone()
+                cells = json.loads(row[0]) if row else []
+                cells.extend([''] * (col_index - len(cells)))
+                cells[col_index - 1] = str(value)
+                db.execute("INSERT OR REPLACE INTO sheet_rows (sheet, row_index, key, cells) VALUES (?, ?, ?, ?)",
+                           (title, row_index, cells[0], json.dumps(cells, ensure_ascii=False)))
+
+    def append_rows(self, title, rows):
+        db = self.connect()
+        last = db.execute("SELECT MAX(row_index) FROM sheet_rows WHERE sheet = ?", (title,)).fetchone()[0] or 0
+        for offset, row in enumerate(rows, start=1):
+            self.put_row(title, last + offset, [str(cell) for cell in row])
+
+    def delete_row(self, title, row_index):
+        """Удаляет строку и сдвигает нижние строки вверх, как worksheet.delete_row."""
+        db = self.connect()
+        with db:
+            db.execute("BEGIN")
+            db.execute("DELETE FROM sheet_rows WHERE sheet = ? AND row_index = ?", (title, row_index))
+            # Сдвиг в два шага, чтобы не столкнуться с первичным ключом соседней строки
+            db.execute("UPDATE sheet_rows SET row_index = -(row_index - 1) WHERE sheet = ? AND row_index > ?",
+                       (title, row_index))
+            db.execute("UPDATE sheet_rows SET row_index = -row_index WHERE sheet = ? AND row_index < 0", (title,))
+
+    async def sync(self, key):
+        spreadsheet, title = self.sources.get(key, (sheets.SPREADSHEET_NAME, key))
+        worksheet = await sheets.get_worksheet(title, spreadsheet, priority=sheets.PRIORITY_LOW)
+        values = await sheets.call(worksheet.get_all_values, priority=sheets.PRIORITY_LOW)
+        self.replace(key, values)
+        logging.info("Локальная копия листа %s обновлена: %d строк", key, len(values))
+
+    async def run(self):
+        while True:
+            for title in list(self.watched):
+                try:
+                    await self.sync(title)
+                except Exception as e:
+                    logging.error("Ошибка при обновлении локальной копии листа %s: %s", title, e)
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    def start(self):
+        if self.task is None:
+            self.connect()
+            self.task = asyncio.create_task(self.run())
+        return self.task
+
+
+def sheet_key(title, spreadsheet=sheets.SPREADSHEET_NAME):
+    # Листы основной таблицы хранятся под своим названием, листы других таблиц - с её именем
+    return title if spreadsheet == sheets.SPREADSHEET_NAME else f"{spreadsheet}/{title}"
+
+
+mirror = Mirror()
+
+
+def watch(title, spreadsheet=sheets.SPREADSHEET_NAME):
+    return mirror.watch(title, spreadsheet)
+
+
+def synced_at(title):
+    return mirror.synced_at(title)
+
+
+def is_fresh(title):
+    return mirror.is_fresh(title)
+
+
+def replace(title, values):
+    mirror.replace(title, values)
+
+
+def rows(title):
+    return mirror.rows(title)
+
+
+def find(title, key):
+    return mirror.find(title, key)
+
+
+def put_row(title, row_index, cells):
+    mirror.put_row(title, row_index, cells)
+
+
+def update_cells(title, updates):
+    mirror.update_cells(title, updates)
+
+
+def append_rows(title, rows):
+    mirror.append_rows(title, rows)
+
+
+def delete_row(title, row_index):
+    mirror.delete_row(title, row_index)
+
+
+def start():
+    return mirror.start()
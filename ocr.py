@@ -0,0 +1,79 @@
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import re
+
+# Распознавание характеристик со скриншота Gear Score. OpenCV и Tesseract
+# занимают процессор на сотни миллисекунд, поэтому работают в пуле процессов,
+# а результат запоминается по хэшу картинки.
+MAX_WORKERS = 2
+CACHE_SIZE = 256
+
+# Области характеристик в долях ширины и высоты скриншота: (x0, y0, x1, y1).
+# Подобраны под вкладку снаряжения (image.png): числа прижаты к правому краю
+# под иконками - «Прогресс», «Урон», «Меткость», «ЗЩТ». Уровня на этом экране
+# нет, его игрок вводит сам. При изменении интерфейса игры области нужно
+# поправить здесь.
+STAT_REGIONS = {
+    'gear_score': (0.72, 0.735, 0.95, 0.775),
+    'attack': (0.80, 0.81, 0.95, 0.85),
+    'accuracy': (0.80, 0.89, 0.95, 0.93),
+    'defence': (0.80, 0.93, 0.95, 0.97),
+}
+STAT_NAMES = {
+    'lvl': "Уровень",
+    'attack': "Атака",
+    'defence': "Защита",
+    'accuracy': "Точность",
+    'gear_score': "Gear Score",
+}
+TESSERACT_CONFIG = '--psm 7 -c tessedit_char_whitelist=0123456789'
+
+executor = None
+cache = collections.OrderedDict()  # хэш картинки -> распознанные значения
+
+
+def extract_stats(data):
+    """Вырезает области характеристик и распознаёт числа. Выполняется в дочернем процессе."""
+    import cv2
+    import numpy
+    import pytesseract
+
+    image = cv2.imdecode(numpy.frombuffer(data, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return {key: None for key in STAT_REGIONS}
+
+    height, width = image.shape
+    stats = {}
+    for key, (x0, y0, x1, y1) in STAT_REGIONS.items():
+        region = image[int(y0 * height):int(y1 * height), int(x0 * width):int(x1 * width)]
+        # Мелкий светлый текст на тёмном фоне: увеличиваем и бинаризуем по Оцу
+        region = cv2.resize(region, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+        _, region = cv2.threshold(region, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        digits = re.sub(r'\D', '', pytesseract.image_to_string(region, config=TESSERACT_CONFIG))
+        stats[key] = digits or None
+    return stats
+
+
+async def read_stats(data):
+    """Значения характеристик со скриншота; None для того, что распознать не удалось."""
+    global executor
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in cache:
+        cache.move_to_end(digest)
+        return dict(cache[digest])
+
+    if executor is None:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        stats = await asyncio.get_running_loop().run_in_executor(executor, extract_stats, data)
+    except Exception as e:
+        logging.error("Ошибка при распознавании скриншота: %s", e)
+        return {key: None for key in STAT_REGIONS}
+
+    cache[digest] = stats
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return dict(stats)
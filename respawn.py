@@ -0,0 +1,180 @@
+import logging
+import sqlite3
+import time
+import numpy as np
+import metrics
+
+# История убийств боссов по столбцам: время убийства и время появления лежат в
+# массивах NumPy, поэтому интервалы появления по всем боссам, режимам и каналам
+# пересчитываются векторно за миллисекунды даже на десятках тысяч записей.
+# Каждое подтверждение 👍/👎 сразу дописывается и уточняет окно своего босса.
+HISTORY_FILE = 'history.sqlite3'
+MIN_SAMPLES = 5  # Меньше подтверждённых появлений - окну не доверяем и берём уровень выше
+WINDOW_QUANTILES = (0.1, 0.5, 0.9)  # Раннее, ожидаемое и позднее появление
+MAX_INTERVAL_FACTOR = 2  # Интервалы длиннее двух табличных считаем ошибкой отметки
+
+UNKNOWN, MISSED, APPEARED = -1, 0, 1
+
+
+class KillHistory:
+    """Убийства по столбцам и окна появления по (босс, режим, канал) и по боссу."""
+
+    def __init__(self, path=HISTORY_FILE, capacity=1024):
+        self.path = path
+        self.db = None
+        self.size = 0
+        self.kill_at = np.empty(capacity, dtype=np.float64)  # Эпоха, секунды
+        self.appeared_at = np.empty(capacity, dtype=np.float64)  # NaN, если появление не подтверждено
+        self.outcome = np.empty(capacity, dtype=np.int8)
+        self.boss = np.empty(capacity, dtype=np.int32)
+        self.group = np.empty(capacity, dtype=np.int32)
+        self.bosses = {}  # имя босса -> код
+        self.groups = {}  # (босс, режим, канал) -> код
+        self.intervals = {}  # ('boss', код) или ('group', код) -> отсортированные интервалы, минуты
+        self.windows = {}  # тот же ключ -> (раннее, ожидаемое, позднее), минуты
+        self.defaults = {}  # табличные интервалы {босс: минуты}
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS kills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                boss TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                kill_at REAL NOT NULL,
+                outcome INTEGER NOT NULL,
+                appeared_at REAL
+            )""")
+        return self.db
+
+    def load(self, defaults=None):
+        """Читает историю с диска и пересчитывает все окна разом."""
+        self.defaults = dict(defaults or {})
+        rows = self.connect().execute(
+            "SELECT boss, difficulty, channel, kill_at, outcome, appeared_at FROM kills ORDER BY id").fetchall()
+        self.size = 0
+        self.reserve(len(rows))
+        for boss, difficulty, channel, kill_at, outcome, appeared_at in rows:
+            self.put(boss, difficulty, channel, kill_at, outcome, appeared_at)
+        self.recompute()
+        logging.info("История убийств загружена: %d записей, окон: %d", self.size, len(self.windows))
+
+    def reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.kill_at):
+            return
+        capacity = max(needed, 2 * len(self.kill_at))
+        for name in ('kill_at', 'appeared_at', 'outcome', 'boss', 'group'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def put(self, boss, difficulty, channel, kill_at, outcome, appeared_at):
+        self.reserve(1)
+        index = self.size
+        self.kill_at[index] = kill_at
+        self.appeared_at[index] = np.nan if appeared_at is None else appeared_at
+        self.outcome[index] = outcome
+        self.boss[index] = self.bosses.setdefault(boss, len(self.bosses))
+        self.group[index] = self.groups.setdefault((boss, difficulty, channel), len(self.groups))
+        self.size += 1
+        return index
+
+    def add(self, boss, difficulty, channel, kill_at, outcome, appeared_at=None):
+        """Дописывает подтверждение и сразу уточняет окна его босса (время - datetime)."""
+        kill_at = kill_at.timestamp()
+        appeared_at = appeared_at.timestamp() if appeared_at is not None else None
+        self.connect().execute(
+            "INSERT INTO kills (boss, difficulty, channel, kill_at, outcome, appeared_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (boss, difficulty, channel, kill_at, outcome, appeared_at))
+        index = self.put(boss, difficulty, channel, kill_at, outcome, appeared_at)
+        if outcome != APPEARED or appeared_at is None:
+            return
+
+        interval = (appeared_at - kill_at) / 60
+        if interval <= 0 or interval > self.defaults.get(boss, np.inf) * MAX_INTERVAL_FACTOR:
+            return
+        for key in (('boss', int(self.boss[index])), ('group', int(self.group[index]))):
+            samples = self.intervals.get(key, np.empty(0))
+            samples = np.insert(samples, np.searchsorted(samples, interval), interval)
+            self.intervals[key] = samples
+            self.windows[key] = tuple(float(samples[int(q * (len(samples) - 1))]) for q in WINDOW_QUANTILES)
+
+    def recompute(self):
+        """Пересчитывает интервалы и окна по всей истории одним проходом NumPy."""
+        size = self.size
+        interval = (self.appeared_at[:size] - self.kill_at[:size]) / 60
+        mask = (self.outcome[:size] == APPEARED) & (interval > 0)  # NaN в сравнении даёт False
+        # Интервалы намного длиннее табличных - ошибочные отметки, а не медленный респавн
+        limits = np.full(len(self.bosses), np.inf)
+        for name, code in self.bosses.items():
+            if name in self.defaults:
+                limits[code] = self.defaults[name] * MAX_INTERVAL_FACTOR
+        mask &= interval <= limits[self.boss[:size]]
+
+        self.intervals = {}
+        self.windows = {}
+        for level, codes in (('boss', self.boss[:size]), ('group', self.group[:size])):
+            keys, values = codes[mask], interval[mask]
+            if not len(keys):
+                continue
+            # Сортировка по (код, интервал): у каждой группы свой отсортированный отрезок
+            order = np.lexsort((values, keys))
+            keys, values = keys[order], values[order]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            counts = np.diff(np.r_[starts, len(keys)])
+            quantiles = np.stack([values[starts + (q * (counts - 1)).astype(np.int64)] for q in WINDOW_QUANTILES],
+                                 axis=1)
+            for start, count, window in zip(starts.tolist(), counts.tolist(), quantiles.tolist()):
+                key = (level, int(keys[start]))
+                self.intervals[key] = values[start:start + count]
+                self.windows[key] = tuple(window)
+
+    def window(self, boss, difficulty, channel):
+        """Окно появления в минутах после убийства или None, если данных мало."""
+        for key in (('group', self.groups.get((boss, difficulty, channel))), ('boss', self.bosses.get(boss))):
+            if key[1] is None:
+                continue
+            samples = self.intervals.get(key)
+            if samples is not None and len(samples) >= MIN_SAMPLES:
+                return self.windows[key]
+        return None
+
+    def report(self):
+        """Выученные интервалы боссов рядом с табличными."""
+        lines = []
+        for name, code in sorted(self.bosses.items()):
+            samples = self.intervals.get(('boss', code))
+            if samples is None:
+                continue
+            early, expected, late = self.windows[('boss', code)]
+            default = f", в таблице {self.defaults[name]}" if name in self.defaults else ''
+            lines.append(f"{name}: {expected:.0f} мин ({early:.0f}-{late:.0f}), "
+                         f"подтверждений {len(samples)}{default}")
+        return "\n".join(lines)
+
+
+history = KillHistory()
+metrics.gauge('boss_history_kills', "Убийств в истории появлений", lambda: history.size)
+
+
+def load(defaults=None):
+    started = time.perf_counter()
+    history.load(defaults)
+    logging.info("Окна появления пересчитаны за %.1f мс", (time.perf_counter() - started) * 1000)
+
+
+def add(boss, difficulty, channel, kill_at, outcome, appeared_at=None):
+    history.add(boss, difficulty, channel, kill_at, outcome, appeared_at)
+
+
+def window(boss, difficulty, channel):
+    return history.window(boss, difficulty, channel)
+
+
+def report():
+    return history.report()
@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import time
+import discord
+import metrics
+
+# Все исходящие запросы к Discord (сообщения, реакции, правки, удаления) идут
+# через очереди по бакетам. Паузы по заголовкам X-RateLimit выдерживает сам
+# discord.py, здесь же запросы одного бакета идут строго друг за другом,
+# одинаковые операции склеиваются, а повторы после ошибок ограничены.
+MAX_RETRIES = 3
+RETRY_DELAY = 1  # Базовая пауза перед повтором, если Discord не сказал, сколько ждать
+
+
+request_seconds = metrics.histogram('discord_request_seconds', "Время запроса к Discord", ('op', 'route'))
+requests_total = metrics.counter('discord_requests_total', "Запросы к Discord", ('op', 'status'))
+rate_limited = metrics.counter('discord_rate_limited_total', "Ответы 429 от Discord", ('op',))
+
+
+class RateLimitLog(logging.Handler):
+    """Считает 429, которые discord.py обработал сам и только записал в лог."""
+
+    def emit(self, record):
+        if record.levelno >= logging.WARNING and '429' in record.getMessage():
+            rate_limited.inc(op='discord.py')
+
+
+logging.getLogger('discord.http').addHandler(RateLimitLog())
+
+
+class Operation:
+    __slots__ = ("merge_key", "target_id", "fn", "args", "kwargs", "futures")
+
+    def __init__(self, merge_key, target_id, fn, args, kwargs):
+        self.merge_key = merge_key
+        self.target_id = target_id  # id сообщения или канала, которого касается операция
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = []
+
+
+class RestDispatcher:
+    """Очереди исходящих запросов по бакетам Discord со склейкой и ограниченными повторами."""
+
+    def __init__(self, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.queues = {}  # бакет -> deque операций
+        self.pending = {}  # ключ склейки -> операция, ещё стоящая в очереди
+        self.workers = {}  # бакет -> задача, разбирающая его очередь
+
+    def submit(self, bucket, merge_key, target_id, fn, *args, **kwargs):
+        """Ставит fn(*args, **kwargs) в очередь бакета и возвращает future с результатом.
+
+        Операция с тем же merge_key, ещё не отправленная, не дублируется: новые
+        аргументы дописываются к ней, а результат получат оба вызова.
+        """
+        future = asyncio.get_running_loop().create_future()
+        operation = self.pending.get(merge_key) if merge_key is not None else None
+        if operation is not None:
+            operation.kwargs.update(kwargs)
+        else:
+            operation = Operation(merge_key, target_id, fn, args, kwargs)
+            self.queues.setdefault(bucket, collections.deque()).append(operation)
+            if merge_key is not None:
+                self.pending[merge_key] = operation
+        operation.futures.append(future)
+
+        if bucket not in self.workers:
+            self.workers[bucket] = asyncio.create_task(self.drain(bucket))
+        return future
+
+    def drop(self, target_id):
+        """Снимает из очередей всё, что ещё не отправлено для удаляемого объекта."""
+        for queue in self.queues.values():
+            for operation in [operation for operation in queue if operation.target_id == target_id]:
+                queue.remove(operation)
+                self.pending.pop(operation.merge_key, None)
+                for future in operation.futures:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def drain(self, bucket):
+        queue = self.queues[bucket]
+        try:
+            while queue:
+                operation = queue.popleft()
+                self.pending.pop(operation.merge_key, None)
+                try:
+                    result = await self.execute(operation, bucket[0])
+                except Exception as e:
+                    for future in operation.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in operation.futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            del self.workers[bucket]
+            if not queue:
+                del self.queues[bucket]
+
+    async def execute(self, operation, route):
+        attempt = 0
+        op = getattr(operation.fn, '__name__', 'call')
+        while True:
+            started = time.monotonic()
+            try:
+                result = await operation.fn(*operation.args, **operation.kwargs)
+                request_seconds.observe(time.monotonic() - started, op=op, route=route)
+                requests_total.inc(op=op, status='ok')
+                return result
+            except discord.HTTPException as e:
+                request_seconds.observe(time.monotonic() - started, op=op, route=route)
+                requests_total.inc(op=op, status=e.status)
+                if e.status == 429:
+                    rate_limited.inc(op=op)
+                # Повторяем только то, что может пройти позже: 429 и ошибки сервера Discord
+                if attempt >= self.max_retries or not (e.status == 429 or e.status >= 500):
+                    raise
+                delay = getattr(e, 'retry_after', None) or RETRY_DELAY * 2 ** attempt
+                attempt += 1
+                logging.warning("Discord ответил %s, повтор %d/%d через %.1f с",
+                                e.status, attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+
+dispatcher = RestDispatcher()
+
+
+def send(channel, content=None, **kwargs):
+    """Отправляет сообщение в канал или пользователю в личные сообщения."""
+    return dispatcher.submit(('send', channel.id), None, channel.id, channel.send, content, **kwargs)
+
+
+def edit(message, **kwargs):
+    # Несколько правок одного сообщения, ждущих в очереди, уходят одним запросом
+    return dispatcher.submit(('send', message.channel.id), ('edit', message.id), message.id, message.edit, **kwargs)
+
+
+async def add_reactions(message, *emojis):
+    futures = [dispatcher.submit(('reaction', message.channel.id), ('reaction', message.id, str(emoji)), message.id,
+                                 message.add_reaction, emoji)
+               for emoji in emojis]
+    return await asyncio.gather(*futures)
+
+
+async def delete_message(message):
+    dispatcher.drop(message.id)
+    try:
+        return await dispatcher.submit(('delete', message.channel.id), ('delete', message.id), None, message.delete)
+    except discord.NotFound:
+        pass  # Сообщение уже удалено
+
+
+async def delete_channel(channel):
+    dispatcher.drop(channel.id)
+    try:
+        return await dispatcher.submit(('channel', channel.id), ('delete', channel.id), None, channel.delete)
+    except discord.NotFound:
+        pass  # Канал уже удалён
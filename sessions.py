@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import metrics
+
+# Ограничения на одновременно открытые мастера
+MAX_SESSIONS_PER_USER = 1  # Для каждого вида мастера
+MAX_SESSIONS = 50  # Всего на весь бот
+SWEEP_INTERVAL = 5  # Как часто проверяем истёкшие сессии, секунды
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    """Открытый мастер пользователя."""
+
+    __slots__ = ("kind", "user_id", "channel_id", "expires_at", "on_expire", "data")
+
+    def __init__(self, kind, user_id, ttl, on_expire=None):
+        self.kind = kind
+        self.user_id = user_id
+        self.channel_id = None
+        self.expires_at = time.monotonic() + ttl
+        self.on_expire = on_expire  # Корутина-функция, вызывается с сессией после истечения
+        self.data = {}
+
+
+class SessionRegistry:
+    """Реестр сессий по id пользователя и таблица маршрутов сообщений по id канала."""
+
+    def __init__(self, max_per_user=MAX_SESSIONS_PER_USER, max_total=MAX_SESSIONS):
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.by_user = {}  # (вид, id пользователя) -> список сессий
+        self.routes = {}  # id канала -> обработчик сообщений
+        self.expiry = []  # куча (время истечения, порядковый номер, сессия)
+        self.counter = itertools.count()
+        self.count = 0
+        self.sweeper = None
+
+    def open(self, kind, user_id, ttl, on_expire=None):
+        """Открывает сессию или бросает SessionLimitError, если лимит исчерпан."""
+        user_sessions = self.by_user.setdefault((kind, user_id), [])
+        if len(user_sessions) >= self.max_per_user:
+            raise SessionLimitError("У вас уже есть открытая сессия.")
+        if self.count >= self.max_total:
+            raise SessionLimitError("Сейчас открыто слишком много сессий, попробуйте позже.")
+
+        session = Session(kind, user_id, ttl, on_expire)
+        user_sessions.append(session)
+        self.count += 1
+        self.schedule(session)
+        self.start()
+        return session
+
+    def get(self, kind, user_id):
+        user_sessions = self.by_user.get((kind, user_id))
+        return user_sessions[0] if user_sessions else None
+
+    def bind_channel(self, session, channel_id, handler=None):
+        """Привязывает канал к сессии; сообщения в нём пойдут в handler."""
+        session.channel_id = channel_id
+        if handler is not None:
+            self.routes[channel_id] = handler
+
+    def extend(self, session, ttl):
+        """Переносит истечение сессии на ttl секунд от текущего момента."""
+        session.expires_at = time.monotonic() + ttl
+        self.schedule(session)
+
+    def close(self, session):
+        user_sessions = self.by_user.get((session.kind, session.user_id))
+        if not user_sessions or session not in user_sessions:
+            return
+        user_sessions.remove(session)
+        if not user_sessions:
+            del self.by_user[(session.kind, session.user_id)]
+        if session.channel_id is not None:
+            self.routes.pop(session.channel_id, None)
+        self.count -= 1
+
+    def is_open(self, session):
+        return session in self.by_user.get((session.kind, session.user_id), ())
+
+    def schedule(self, session):
+        # Старые записи кучи не удаляем: при разборе сверяемся с текущим expires_at
+        heapq.heappush(self.expiry, (session.expires_at, next(self.counter), session))
+
+    async def sweep(self):
+        """Единственная задача, закрывающая истёкшие сессии."""
+        while True:
+            now = time.monotonic()
+            while self.expiry and self.expiry[0][0] <= now:
+                expires_at, _, session = heapq.heappop(self.expiry)
+                if expires_at != session.expires_at or not self.is_open(session):
+                    continue
+                self.close(session)
+                if session.on_expire is not None:
+                    asyncio.create_task(self.expire(session))
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    async def expire(self, session):
+        try:
+            await session.on_expire(session)
+        except Exception as e:
+            logging.error("Ошибка при закрытии сессии %s: %s", session.kind, e)
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep())
+
+
+registry = SessionRegistry()
+
+
+def active_sessions():
+    counts = {}
+    for (kind, _), user_sessions in registry.by_user.items():
+        counts[kind] = counts.get(kind, 0) + len(user_sessions)
+    return counts
+
+
+metrics.gauge('sessions_active', "Открытых сессий мастеров", active_sessions, ('kind',))
+
+
+def route(channel_id):
+    """Обработчик сообщений канала или None - для всех каналов, которые боту не интересны."""
+    return registry.routes.get(channel_id)
+
+
+def add_route(channel_id, handler):
+    registry.routes[channel_id] = handler
+
+
+def open(kind, user_id, ttl, on_expire=None):
+    return registry.open(kind, user_id, ttl, on_expire)
+
+
+def get(kind, user_id):
+    return registry.get(kind, user_id)
+
+
+def bind_channel(session, channel_id, handler=None):
+    registry.bind_channel(session, channel_id, handler)
+
+
+def extend(session, ttl):
+    registry.extend(session, ttl)
+
+
+def close(session):
+    registry.close(session)
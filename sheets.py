@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import logging
+import time
+import gspread
+import metrics
+from oauth2client.service_account import ServiceAccountCredentials
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+CREDENTIALS_FILE = 'credentials.json'
+SPREADSHEET_NAME = "NightCrowsApp"
+
+# Квота Google Sheets API: 60 запросов в минуту на пользователя
+REQUESTS_PER_MINUTE = 60
+# Сколько запросов можно отправить подряд без ожидания; входит в минутную квоту, а не добавляется к ней
+REQUESTS_BURST = 10
+# Повторы после 429: пауза удваивается от RETRY_BACKOFF до RETRY_BACKOFF_MAX секунд
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 2
+RETRY_BACKOFF_MAX = 64
+# Сколько вызовов gspread выполняется одновременно
+MAX_WORKERS = 4
+
+# Сколько секунд держим открытые таблицы и листы без повторного запроса метаданных
+HANDLE_TTL = 30 * 60
+
+# Чем меньше число, тем раньше выполняется вызов
+PRIORITY_HIGH = 0  # Запись убийства босса и всё, чего ждёт пользователь
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10  # Фоновые выгрузки отметок и обновление кэша
+
+
+call_seconds = metrics.histogram('sheets_call_seconds', "Время вызова Google Sheets вместе с ожиданием квоты",
+                                 ('op', 'worksheet'))
+call_errors = metrics.counter('sheets_errors_total', "Ошибки вызовов Google Sheets", ('op', 'status'))
+call_retries = metrics.counter('sheets_retries_total', "Повторы вызовов Google Sheets после 429", ('op',))
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов «ведро с токенами»."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SheetsGateway:
+    """Выполняет блокирующие вызовы gspread в пуле потоков с учётом квоты и приоритета."""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=REQUESTS_BURST, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        # За любые 60 секунд ведро отдаёт не больше burst + rate * 60 = requests_per_minute токенов
+        burst = min(burst, requests_per_minute)
+        self.bucket = TokenBucket(max(requests_per_minute - burst, 1) / 60.0, burst)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        self.queue = None
+        self.workers = []
+        self.counter = itertools.count()
+
+    def start(self):
+        # Очередь создаём лениво, уже внутри работающего цикла событий бота
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.max_workers)]
+
+    async def call(self, fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Ставит вызов fn(*args, **kwargs) в очередь и возвращает его результат.
+
+        Ответ 429 значит, что запрос не выполнен: его повторяем с растущей паузой.
+        """
+        self.start()
+        job = functools.partial(fn, *args, **kwargs)
+        op = getattr(fn, '__name__', 'call')
+        worksheet = getattr(getattr(fn, '__self__', None), 'title', '')
+        started = time.monotonic()
+        try:
+            for attempt in range(RETRY_ATTEMPTS + 1):
+                future = asyncio.get_running_loop().create_future()
+                self.queue.put_nowait((priority, next(self.counter), job, future))
+                try:
+                    return await future
+                except gspread.exceptions.APIError as e:
+                    if not is_quota_error(e) or attempt == RETRY_ATTEMPTS:
+                        raise
+                    delay = min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX)
+                    logging.warning("Google Sheets ответил 429 на %s, повтор через %d с", op, delay)
+                    call_retries.inc(op=op)
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None) or type(e).__name__
+            call_errors.inc(op=op, status=status)
+            raise
+        finally:
+            call_seconds.observe(time.monotonic() - started, op=op, worksheet=worksheet)
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Токен берём только под уже существующую задачу, иначе простаивающие
+            # воркеры тратили бы квоту на запросы, которых ещё нет
+            item = await self.queue.get()
+            if item[3].cancelled():
+                self.queue.task_done()
+                continue
+            await self.bucket.acquire()
+            if not self.queue.empty():
+                # Пока ждали токен, могла прийти более срочная задача: выполняем её первой
+                self.queue.put_nowait(item)
+                self.queue.task_done()
+                item = self.queue.get_nowait()
+            priority, _, job, future = item
+            try:
+                if future.cancelled():
+                    continue
+                try:
+                    result = await loop.run_in_executor(self.executor, job)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+
+class HandleCache:
+    """Кэш открытых таблиц и их листов по названию."""
+
+    def __init__(self, ttl=HANDLE_TTL):
+        self.ttl = ttl
+        self.spreadsheets = {}  # имя таблицы -> (таблица, время открытия)
+        self.worksheets = {}  # (имя таблицы, название листа) -> лист
+        self.lock = None
+
+    async def spreadsheet(self, name=SPREADSHEET_NAME, priority=PRIORITY_NORMAL):
+        entry = self.spreadsheets.get(name)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            # Пока ждали блокировку, таблицу мог открыть другой вызов
+            entry = self.spreadsheets.get(name)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                return entry[0]
+
+            self.invalidate(name)
+            logging.info("Открываем таблицу %s", name)
+            spreadsheet = await gateway.call(get_client().open, name, priority=priority)
+            self.spreadsheets[name] = (spreadsheet, time.monotonic())
+            return spreadsheet
+
+    async def worksheet(self, title, spreadsheet=SPREADSHEET_NAME, priority=PRIORITY_NORMAL):
+        handle = await self.spreadsheet(spreadsheet, priority)
+        worksheet = self.worksheets.get((spreadsheet, title))
+        if worksheet is None:
+            try:
+                worksheet = await gateway.call(handle.worksheet, title, priority=priority)
+            except gspread.exceptions.WorksheetNotFound:
+                # Лист могли переименовать или удалить: в следующий раз откроем таблицу заново
+                self.invalidate(spreadsheet)
+                raise
+            self.worksheets[(spreadsheet, title)] = worksheet
+        return worksheet
+
+    def invalidate(self, spreadsheet=None):
+        """Сбрасывает закэшированные дескрипторы таблицы (или всех таблиц)."""
+        if spreadsheet is None:
+            self.spreadsheets.clear()
+            self.worksheets.clear()
+            return
+        self.spreadsheets.pop(spreadsheet, None)
+        for key in [key for key in self.worksheets if key[0] == spreadsheet]:
+            del self.worksheets[key]
+
+
+def is_quota_error(error):
+    return getattr(getattr(error, 'response', None), 'status_code', None) == 429
+
+
+def is_stale_handle_error(error):
+    """Ошибки, после которых закэшированным дескрипторам нельзя доверять."""
+    if isinstance(error, (gspread.exceptions.WorksheetNotFound, gspread.exceptions.SpreadsheetNotFound)):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        return getattr(error.response, 'status_code', None) in (403, 404)
+    return False
+
+
+client = None
+gateway = SheetsGateway()
+handles = HandleCache()
+metrics.gauge('sheets_queue_depth', "Вызовов Sheets в очереди",
+              lambda: gateway.queue.qsize() if gateway.queue is not None else 0)
+
+
+def get_client():
+    """Возвращает общий авторизованный клиент gspread."""
+    global client
+    if client is None:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPE)
+        client = gspread.authorize(creds)
+    return client
+
+
+async def call(fn, *args, priority=PRIORITY_NORMAL, **kwargs):
+    """Асинхронно выполняет вызов gspread через общий шлюз."""
+    try:
+        return await gateway.call(fn, *args, priority=priority, **kwargs)
+    except Exception as e:
+        if is_stale_handle_error(e):
+            logging.warning("Сбрасываем кэш листов после ошибки: %s", e)
+            handles.invalidate()
+        raise
+
+
+async def get_worksheet(title, spreadsheet=SPREADSHEET_NAME, priority=PRIORITY_NORMAL):
+    """Возвращает лист из кэша, открывая таблицу только при необходимости."""
+    return await handles.worksheet(title, spreadsheet, priority)
@@ -1,28 +1,49 @@
-import os
 import discord
+import gspread
 import logging
 import asyncio
 import datetime
+import heapq
+import itertools
+import json
 from discord.ext import commands, tasks
-from oauth2client.service_account import ServiceAccountCredentials
-import gspread
-from dotenv import load_dotenv
-
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Определяем доступы для Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name('credentials.json', scope)
-client = gspread.authorize(creds)
-
-# Словарь для хранения времени последнего уведомления о спавне для каждого босса
-last_notification_time = {}
-boss_cache = []
-cache_last_update = datetime.datetime.now() - datetime.timedelta(minutes=15)
+import data
+import guilds
+import journal
+import metrics
+import mirror
+import respawn
+import rest
+import sheets
+
+bot = None  # Общий бот, задаётся при загрузке расширения в setup()
+
+BOSS_SHEET = "Boss"
+
+# Обработанные убийства переносятся в архив пачкой раз в цикл: строки ищутся по id,
+# а не по номеру из кэша, который мог устареть после удаления строк выше
+ARCHIVE_SHEET = "Boss архив"
+ARCHIVE_HEADER = ['Босс', 'Время', 'Зона', 'Сложность', 'Канал', 'Появился', 'Тайм', 'ID']
+ARCHIVE_FLUSH_DELAY = 60
+
+# Инкрементальная синхронизация листа Boss
+FULL_SYNC_EVERY = 4  # Каждая 4-я синхронизация (раз в час) перечитывает лист целиком
+record_ids = itertools.count(1)
+
+# Очередь планировщика: куча (время, порядковый номер, действие, ключ)
+ALERT_BEFORE_SPAWN = datetime.timedelta(minutes=5)
+ALERT_CONFIRM_TIMEOUT = datetime.timedelta(minutes=50)  # Сколько ждём 👍/👎 под уведомлением
+schedule_counter = itertools.count()
+history_loaded = False
+
+# Лист Boss меняют по номерам строк синхронизация (запись id) и перенос в архив
+# (удаление строк). Оба держат блокировку таблицы, чтобы строки не сдвинулись
+# между чтением листа и записью; таблицу могут делить несколько серверов
+boss_locks = {}  # таблица -> asyncio.Lock
+
+# У каждого сервера свой кэш листа Boss его таблицы, своя очередь уведомлений
+# и свой планировщик; история появлений общая
+states = {}  # id сервера -> GuildSpawns
 
 # Интервалы появления боссов в минутах
 boss_spawn_times = {
@@ -36,199 +57,747 @@ boss_spawn_times = {
     "Gehenna": 8 * 60 + 30
 }
 
-intents = discord.Intents.default()
-intents.messages = True
-intents.message_content = True
-intents.reactions = True
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-async def get_boss_worksheet():
-    retries = 3
-    for i in range(retries):
+metrics.gauge('boss_cache_size', "Записей в кэше боссов",
+              lambda: {guild_id: len(state.boss_cache) for guild_id, state in states.items()}, ('guild',))
+metrics.gauge('boss_cache_age_seconds', "Секунд с последнего обновления кэша боссов",
+              lambda: {guild_id: (datetime.datetime.now() - state.cache_last_update).total_seconds()
+                       for guild_id, state in states.items()}, ('guild',))
+metrics.gauge('spawn_alerts_pending', "Уведомлений о спавне, ждущих ответа",
+              lambda: {guild_id: len(state.pending_alerts) for guild_id, state in states.items()}, ('guild',))
+
+
+class BossRecord:
+    """Запись об убийстве босса с разобранным временем и постоянным uid."""
+
+    __slots__ = ("uid", "kill_id", "name", "kill_time", "zone", "difficulty", "channel", "row_index", "spawn_time",
+                 "window", "alert_time")
+
+    def __init__(self, name, kill_time, zone, difficulty, channel, row_index, kill_id=''):
+        self.uid = next(record_ids)
+        self.kill_id = kill_id
+        self.name = name
+        self.kill_time = kill_time
+        self.zone = zone
+        self.difficulty = difficulty
+        self.channel = channel
+        self.row_index = row_index
+        # Время появления считаем при загрузке и после новых подтверждений, а не на каждой проверке
+        self.predict()
+
+    def predict(self):
+        """Обновляет ожидаемое время появления; возвращает True, если время уведомления сдвинулось."""
+        window = respawn.window(self.name, self.difficulty, self.channel)
+        if window is not None:
+            # Окно из подтверждённых появлений этого босса
+            early, expected, late = window
+            self.spawn_time = self.kill_time + datetime.timedelta(minutes=expected)
+            self.window = (self.kill_time + datetime.timedelta(minutes=early),
+                           self.kill_time + datetime.timedelta(minutes=late))
+        else:
+            self.spawn_time = self.kill_time + datetime.timedelta(minutes=boss_spawn_times.get(self.name, 0))
+            self.window = None
+        alert_time = min(self.spawn_time, self.window[0] if self.window else self.spawn_time) - ALERT_BEFORE_SPAWN
+        changed = alert_time != getattr(self, 'alert_time', None)
+        self.alert_time = alert_time
+        return changed
+
+    def window_text(self):
+        if self.window is None:
+            return ''
+        return f" (окно {self.window[0]:%H:%M}-{self.window[1]:%H:%M})"
+
+    def key(self):
+        return self.name, self.kill_time, self.zone, self.difficulty, self.channel, self.kill_id
+
+
+def parse_boss_row(row, row_index):
+    # Проверяем на наличие данных только в первых пяти столбцах
+    if len(row) < 5 or not all(row[:5]):
+        return None
+    try:
+        kill_time = datetime.datetime.strptime(row[1].strip(), "%d.%m.%Y %H:%M")  # Удаляем лишние пробелы
+    except ValueError as ve:
+        logging.warning("Ошибка при разборе времени: %s. Строка: %s", ve, row[1])
+        return None
+    return BossRecord(row[0], kill_time, row[2], row[3], row[4], row_index, row_kill_id(row))
+
+
+def row_kill_id(row):
+    return row[data.KILL_ID_COLUMN - 1].strip() if len(row) >= data.KILL_ID_COLUMN else ''
+
+
+def row_signature(row):
+    return tuple((list(row[:5]) + [''] * 5)[:5])
+
+
+def id_column_letter():
+    return gspread.utils.rowcol_to_a1(1, data.KILL_ID_COLUMN)[:-1]
+
+
+class AlertStore:
+    """Отправленные уведомления на диске, в базе журнала.
+
+    После перезапуска ответы на ещё открытые уведомления доходят до архива и
+    истории, а о боссе, о котором уже уведомили, не уведомляем второй раз.
+    """
+
+    def __init__(self):
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            self.db = journal.journal.connect()
+            self.db.execute("""CREATE TABLE IF NOT EXISTS spawn_alerts (
+                message_id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                boss TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS spawn_notified (
+                guild_id INTEGER NOT NULL,
+                kill_id TEXT NOT NULL,
+                PRIMARY KEY (guild_id, kill_id)
+            )""")
+        return self.db
+
+    def save_alert(self, guild_id, message_id, boss, expires_at):
+        record = [boss.kill_id, boss.name, boss.kill_time.strftime("%d.%m.%Y %H:%M"), boss.zone, boss.difficulty,
+                  boss.channel]
+        self.connect().execute(
+            "INSERT OR REPLACE INTO spawn_alerts (message_id, guild_id, boss, expires_at) VALUES (?, ?, ?, ?)",
+            (message_id, guild_id, json.dumps(record, ensure_ascii=False), expires_at.timestamp()))
+
+    def delete_alert(self, message_id):
+        self.connect().execute("DELETE FROM spawn_alerts WHERE message_id = ?", (message_id,))
+
+    def load_alerts(self):
+        """Открытые уведомления: (сервер, id сообщения, запись босса, время истечения)."""
+        alerts = []
+        for message_id, guild_id, record, expires_at in self.connect().execute(
+                "SELECT message_id, guild_id, boss, expires_at FROM spawn_alerts").fetchall():
+            kill_id, name, kill_time, zone, difficulty, channel = json.loads(record)
+            boss = BossRecord(name, datetime.datetime.strptime(kill_time, "%d.%m.%Y %H:%M"), zone, difficulty,
+                              channel, 0, kill_id)
+            alerts.append((guild_id, message_id, boss, datetime.datetime.fromtimestamp(expires_at)))
+        return alerts
+
+    def save_notified(self, guild_id, kill_id):
+        self.connect().execute("INSERT OR IGNORE INTO spawn_notified (guild_id, kill_id) VALUES (?, ?)",
+                               (guild_id, kill_id))
+
+    def delete_notified(self, guild_id, kill_ids):
+        self.connect().executemany("DELETE FROM spawn_notified WHERE guild_id = ? AND kill_id = ?",
+                                   [(guild_id, kill_id) for kill_id in kill_ids])
+
+    def load_notified(self):
+        notified = {}
+        for guild_id, kill_id in self.connect().execute("SELECT guild_id, kill_id FROM spawn_notified"):
+            notified.setdefault(guild_id, set()).add(kill_id)
+        return notified
+
+
+alert_store = AlertStore()
+
+
+class GuildSpawns:
+    """Кэш листа Boss и планировщик уведомлений одного сервера."""
+
+    def __init__(self, guild_id, config):
+        self.guild_id = guild_id
+        self.config = config
+        # Копию листа Boss обновляет только полная синхронизация под boss_lock, а не фоновая
+        # задача зеркала: её чтение могло бы разойтись с одновременным переносом в архив
+        self.boss_sheet = mirror.sheet_key(BOSS_SHEET, config.spreadsheet)
+        self.alert_channel_id = None  # Канал уведомлений ищем по имени один раз
+
+        self.boss_cache = {}  # uid записи -> BossRecord
+        self.cache_last_update = datetime.datetime.now() - datetime.timedelta(minutes=15)
+        self.synced_rows = 1  # Последняя строка листа, учтённая в кэше (1 - заголовок)
+        self.last_row_values = None  # Содержимое этой строки, чтобы заметить ручные правки листа
+        self.syncs_since_full = FULL_SYNC_EVERY
+
+        self.spawn_heap = []
+        self.scheduled_bosses = {}  # uid записи -> запись кэша, ожидающая уведомления
+        self.notified_bosses = set()  # uid записей, о которых уже уведомили
+        self.notified_kills = set()  # id убийств, о которых уведомили, в том числе до перезапуска
+        self.schedule_changed = asyncio.Event()
+        self.scheduler_task = None
+        self.pending_alerts = {}  # id сообщения с уведомлением -> запись босса, ожидающая подтверждения
+
+    async def get_boss_worksheet(self):
+        # Лист берётся из кэша; при ошибке кэш сбрасывается и следующий вызов откроет таблицу заново
         try:
-            worksheet = client.open("NightCrowsApp").worksheet("Boss")
-            return worksheet
+            return await sheets.get_worksheet(BOSS_SHEET, self.config.spreadsheet)
         except Exception as e:
-            logging.error("Ошибка при получении рабочего листа Boss: %s", e)
-            if i < retries - 1:  # Если это не последняя попытка
-                await asyncio.sleep(61)  # Подождите 61 секунду перед повторной попыткой
-    return None
-
-async def update_boss_cache():
-    global cache_last_update, boss_cache
-    now = datetime.datetime.now()
-
-    if (now - cache_last_update).total_seconds() >= 15 * 60:
-        logging.info("Обновление кэша боссов...")
-        worksheet = await get_boss_worksheet()
-        if worksheet is None:
-            logging.error("Не удалось получить рабочий лист Boss.")
+            logging.error("Ошибка при получении рабочего листа Boss таблицы %s: %s", self.config.spreadsheet, e)
+            return None
+
+    async def update_boss_cache(self, force=False):
+        now = datetime.datetime.now()
+
+        if force or (now - self.cache_last_update).total_seconds() >= 15 * 60:
+            logging.info("Обновление кэша боссов сервера %s...", self.guild_id)
+            worksheet = await self.get_boss_worksheet()
+            if worksheet is None:
+                logging.error("Не удалось получить рабочий лист Boss.")
+                return
+
+            try:
+                async with boss_lock(self.config.spreadsheet):
+                    if self.syncs_since_full < FULL_SYNC_EVERY and await self.sync_boss_tail(worksheet):
+                        self.syncs_since_full += 1
+                    else:
+                        # Плановую полную синхронизацию берём из свежей локальной копии (её могла обновить
+                        # синхронизация другого сервера с той же таблицей), после ручной правки - из таблицы
+                        await self.sync_boss_full(worksheet, from_mirror=self.syncs_since_full >= FULL_SYNC_EVERY)
+                        self.syncs_since_full = 0
+                logging.info(f"Кэш обновлен: {len(self.boss_cache)} босс(ов) в кэше.")
+            except Exception as e:
+                logging.error("Ошибка при обновлении кэша: %s", e)
+            finally:
+                self.cache_last_update = now
+
+    async def sync_boss_tail(self, worksheet):
+        """Догружает строки, добавленные после прошлой синхронизации.
+
+        Возвращает False, если последняя известная строка изменилась - значит,
+        лист правили вручную и нужна полная синхронизация.
+        """
+        # Вместе с новыми строками перечитываем последнюю известную, чтобы сверить её
+        rows = await sheets.call(worksheet.get, f"A{self.synced_rows}:{id_column_letter()}",
+                                 priority=sheets.PRIORITY_LOW)
+        if self.synced_rows > 1 and self.last_row_values is not None:
+            if not rows or row_signature(rows[0]) != self.last_row_values:
+                logging.info("Лист Boss изменён вне бота, выполняем полную синхронизацию.")
+                return False
+
+        new_rows = rows[1:]
+        records = []
+        for row_index, row in enumerate(new_rows, start=self.synced_rows + 1):
+            mirror.put_row(self.boss_sheet, row_index, row)
+            record = parse_boss_row(row, row_index)
+            if record is not None:
+                self.boss_cache[record.uid] = record
+                self.schedule_boss(record)
+                records.append(record)
+        await self.assign_kill_ids(worksheet, records)
+
+        if new_rows:
+            self.synced_rows += len(new_rows)
+            self.last_row_values = row_signature(new_rows[-1])
+        logging.info(f"Догружено строк листа Boss: {len(new_rows)}")
+        return True
+
+    async def sync_boss_full(self, worksheet, from_mirror=False):
+        """Перечитывает лист целиком, сохраняя uid уже известных записей."""
+        all_rows = mirror.rows(self.boss_sheet) if from_mirror and mirror.is_fresh(self.boss_sheet) else None
+        if all_rows is not None and any(len(row) >= 5 and all(row[:5]) and not row_kill_id(row)
+                                        for row in all_rows[1:]):
+            # Строки без id добавили вручную: номера строк для записи id берём только из самой таблицы
+            all_rows = None
+        if all_rows is None:
+            logging.info("Получение данных с рабочего листа...")
+            all_rows = await sheets.call(worksheet.get_all_values, priority=sheets.PRIORITY_LOW)
+            mirror.replace(self.boss_sheet, all_rows)
+
+        known = {}
+        for record in sorted(self.boss_cache.values(), key=lambda r: r.row_index):
+            known.setdefault(record.key(), []).append(record)
+
+        new_cache = {}
+        for row_index, row in enumerate(all_rows[1:], start=2):  # Получаем все строки начиная со второй
+            record = parse_boss_row(row, row_index)
+            if record is None:
+                continue
+            # Одинаковые строки сопоставляем по порядку, а не схлопываем в одну
+            candidates = known.get(record.key())
+            if candidates:
+                record = candidates.pop(0)
+                record.row_index = row_index
+            new_cache[record.uid] = record
+
+        self.boss_cache = new_cache
+        await self.assign_kill_ids(worksheet, self.boss_cache.values())
+        self.synced_rows = max(len(all_rows), 1)
+        self.last_row_values = row_signature(all_rows[-1]) if len(all_rows) > 1 else None
+        self.sync_spawn_schedule(self.boss_cache.values())
+
+    async def assign_kill_ids(self, worksheet, records):
+        """Выдаёт id строкам, добавленным в лист вручную, одним batch_update.
+
+        Вызывается под boss_lock: номера строк только что прочитаны из таблицы.
+        """
+        records = [record for record in records if not record.kill_id]
+        if not records:
             return
-
-        logging.info("Получение данных с рабочего листа...")
+        for record in records:
+            record.kill_id = data.new_kill_id()
+        updates = [{'range': gspread.utils.rowcol_to_a1(record.row_index, data.KILL_ID_COLUMN),
+                    'values': [[record.kill_id]]} for record in records]
         try:
-            all_rows = worksheet.get_all_values()[1:]  # Получаем все строки начиная со второй
-            boss_cache = []  # Сбрасываем кэш перед обновлением
-
-            for row in all_rows:
-                # Проверяем на наличие данных только в первых пяти столбцах
-                if len(row) >= 5 and all(row[:5]):
-                    try:
-                        kill_time = datetime.datetime.strptime(row[1].strip(), "%d.%m.%Y %H:%M")  # Удаляем лишние пробелы
-                        boss_cache.append({
-                            "name": row[0],
-                            "kill_time": row[1],
-                            "zone": row[2],
-                            "difficulty": row[3],  # Получаем сложность
-                            "channel": row[4],  # Получаем канал
-                            "row_index": all_rows.index(row) + 2  # Сохраняем индекс строки для удаления
-                        })
-                    except ValueError as ve:
-                        logging.warning("Ошибка при разборе времени: %s. Строка: %s", ve, row[1])
-            logging.info(f"Кэш обновлен: {len(boss_cache)} босс(ов) добавлено.")
+            await sheets.call(worksheet.batch_update, updates, priority=sheets.PRIORITY_LOW)
         except Exception as e:
-            logging.error("Ошибка при обновлении кэша: %s", e)
-        finally:
-            cache_last_update = now
-
-@tasks.loop(minutes=1)
-async def check_boss_spawn():
-    await update_boss_cache()
-    logging.info("Проверка появления боссов...")
-
-    now = datetime.datetime.now()
-    category = discord.utils.get(bot.guilds[0].categories, name='Бот')  # Укажите правильные категории
-    channel = discord.utils.get(category.text_channels, name='alert_arena')
-
-    for boss in boss_cache:
-        boss_name = boss["name"]
-        kill_time_str = boss["kill_time"]
-        zone = boss["zone"]
-        difficulty = boss["difficulty"]
-        alert_channel = boss["channel"]
-        row_index = boss["row_index"]
-
-        logging.info(f"Обрабатываем босса: {boss_name}")
-
-        if not kill_time_str:
-            logging.warning(f"Пропускаем босса {boss_name}, так как kill_time пуст.")
-            continue
+            logging.error("Не удалось записать id убийств в лист Boss: %s", e)
+            for record in records:
+                record.kill_id = ''
+            return
+        mirror.update_cells(self.boss_sheet,
+                            [(record.row_index, data.KILL_ID_COLUMN, record.kill_id) for record in records])
+        logging.info("Выданы id %d записям листа Boss", len(records))
 
+    def schedule_boss(self, boss):
+        """Ставит уведомление о появлении босса в очередь планировщика."""
+        if boss.uid in self.notified_bosses or boss.uid in self.scheduled_bosses:
+            return
+        if boss.kill_id and boss.kill_id in self.notified_kills:
+            return
+        self.scheduled_bosses[boss.uid] = boss
+        self.push_schedule(boss.alert_time, "alert", boss.uid)
+
+    def push_schedule(self, when, action, key):
+        heapq.heappush(self.spawn_heap, (when, next(schedule_counter), action, key))
+        self.schedule_changed.set()
+
+    def refresh_predictions(self, name):
+        """После нового подтверждения переносит ещё не отправленные уведомления об этом боссе."""
+        for boss in list(self.scheduled_bosses.values()):
+            if boss.name == name and boss.predict():
+                # Старая запись в куче останется, но планировщик узнает её по устаревшему времени
+                self.push_schedule(boss.alert_time, "alert", boss.uid)
+
+    def unschedule_boss(self, uid):
+        # Из кучи запись не удаляем: планировщик пропустит её, когда дойдёт очередь
+        self.scheduled_bosses.pop(uid, None)
+
+    def sync_spawn_schedule(self, bosses):
+        """Приводит очередь уведомлений в соответствие с кэшем боссов."""
+        uids = set()
+        for boss in bosses:
+            uids.add(boss.uid)
+            self.schedule_boss(boss)
+        for uid in [uid for uid in self.scheduled_bosses if uid not in uids]:
+            self.unschedule_boss(uid)
+        self.notified_bosses &= uids
+        # Убийства, которых больше нет в листе (перенесены в архив), забываем и на диске
+        gone = self.notified_kills - {boss.kill_id for boss in self.boss_cache.values()}
+        if gone:
+            self.notified_kills -= gone
+            alert_store.delete_notified(self.guild_id, gone)
+
+    async def wait_for_schedule_change(self, timeout):
+        self.schedule_changed.clear()
         try:
-            kill_time = datetime.datetime.strptime(kill_time_str, "%d.%m.%Y %H:%M")
-        except ValueError as e:
-            logging.warning("Ошибка при разборе времени: %s. Строка: %s", e, kill_time_str)
-            continue
-
-        next_spawn_time = kill_time + datetime.timedelta(minutes=boss_spawn_times.get(boss_name, 0))
-        time_to_spawn = (next_spawn_time - now).total_seconds() / 60
-        time_to_spawn = round(time_to_spawn)
-
+            await asyncio.wait_for(self.schedule_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def spawn_scheduler(self):
+        """Спит до ближайшего уведомления, а не опрашивает кэш каждую минуту."""
+        while True:
+            if not self.spawn_heap:
+                await self.wait_for_schedule_change(None)
+                continue
+
+            when, _, action, key = self.spawn_heap[0]
+            delay = (when - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                # Проснёмся раньше, если в очередь добавят более срочного босса
+                await self.wait_for_schedule_change(delay)
+                continue
+
+            heapq.heappop(self.spawn_heap)
+            if action == "expire":
+                alert = self.take_alert(key)
+                if alert is not None:
+                    logging.info("Пользователь не отреагировал вовремя.")
+                    asyncio.create_task(self.finish_alert(alert))
+                continue
+
+            boss = self.scheduled_bosses.get(key)
+            if boss is None or boss.alert_time != when:
+                continue  # Запись удалили из кэша или уведомление перенесли
+            del self.scheduled_bosses[key]
+
+            self.notified_bosses.add(key)
+            if boss.kill_id:
+                self.notified_kills.add(boss.kill_id)
+                alert_store.save_notified(self.guild_id, boss.kill_id)
+            try:
+                await self.send_spawn_alert(boss)
+            except Exception as e:
+                logging.error("Ошибка при отправке уведомления о боссе %s: %s", boss.name, e)
+
+    def start(self):
+        if self.scheduler_task is None:
+            self.scheduler_task = asyncio.create_task(self.spawn_scheduler())  # Запускаем планировщик уведомлений
+
+    def stop(self):
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+            self.scheduler_task = None
+
+    def alert_channel(self):
+        channel = bot.get_channel(self.alert_channel_id) if self.alert_channel_id else None
+        if channel is None:
+            # Канал ещё не искали или его пересоздали: ищем по имени в категории бота
+            guild = bot.get_guild(self.guild_id)
+            category = discord.utils.get(guild.categories, name=self.config.category) if guild else None
+            channel = discord.utils.get(category.text_channels, name=self.config.alert_channel) if category else None
+            self.alert_channel_id = channel.id if channel else None
+        return channel
+
+    async def send_spawn_alert(self, boss):
+        now = datetime.datetime.now()
+        boss_name = boss.name
+        zone = boss.zone
+        difficulty = boss.difficulty
+        alert_channel = boss.channel
+
+        time_to_spawn = round((boss.spawn_time - now).total_seconds() / 60)
         logging.info(f"Босс: {boss_name}, время до появления: {time_to_spawn} минут.")
 
-        if time_to_spawn <= 0:
-            logging.info(f"Босс {boss_name} уже появился, пропускаем уведомление.")
-            continue
+        channel = self.alert_channel() if time_to_spawn > 0 else None
+        if channel is None:
+            # Без уведомления ответа не будет: убийство сразу уходит в архив, как при истёкшем ожидании
+            if time_to_spawn <= 0:
+                logging.info(f"Босс {boss_name} уже появился, пропускаем уведомление.")
+            else:
+                logging.error(f"Канал уведомлений сервера {self.guild_id} не найден, уведомление о {boss_name} пропущено.")
+            await self.finish_alert(boss)
+            return
 
-        # Уведомление за 5 минут до появления и добавление реакций
-        if 0 < time_to_spawn <= 5:
-            if boss_name not in last_notification_time or now >= last_notification_time[boss_name]:
-                if channel:
-                    msg = await channel.send(f"@everyone Босс \"{boss_name}\" появится в зоне уровня \"{zone}\", "
-                                             f"в режиме \"{difficulty}\" на канале \"{alert_channel}\" через {time_to_spawn} минут.")
-                    await msg.add_reaction("👍")  # палец вверх
-                    await msg.add_reaction("👎")  # палец вниз
-
-                    # Ожидание реакции пользователя
-                    def check(reaction, user):
-                        return user != bot.user and str(reaction.emoji) in ["👍", "👎"] and reaction.message.id == msg.id
-                    try:
-                        reaction, user = await bot.wait_for('reaction_add', timeout=3000.0, check=check)
-                        # Записываем в таблицу
-                        appeared = "Да" if str(reaction.emoji) == "👍" else "Нет"
-                        reaction_time = datetime.datetime.now().strftime("%d.%m.%Y %H:%M")
-                        await update_boss_status(boss, appeared, reaction_time)
-                    except asyncio.TimeoutError:
-                        logging.info("Пользователь не отреагировал вовремя.")
-                    logging.info(f"Уведомление о спавне босса {boss_name} отправлено в канал для уведомлений.")
-                    last_notification_time[boss_name] = now + datetime.timedelta(minutes=5)
-
-                    # Удаление записи из таблицы после отправки уведомления
-                    try:
-                        logging.info(f"Удаление записи для босса {boss_name} из таблицы.")
-                        worksheet = await get_boss_worksheet()  # Получаем обновленный рабочий лист
-                        worksheet.delete_row(row_index)  # Удаляем строку из таблицы
-                        logging.info(f"Запись для босса {boss_name} успешно удалена.")
-                    except Exception as e:
-                        logging.error("Ошибка при удалении записи для босса %s: %s", boss_name, e)
-
-        if time_to_spawn > 5:
-            logging.info(f"Босс {boss_name} появится позже, чем через 5 минут. Время до появления: {time_to_spawn} минут.")
-
-async def update_boss_status(boss, appeared, reaction_time):
-    """Обновляем статус босса в таблице."""
-    worksheet = await get_boss_worksheet()
-    if worksheet is None:
-        logging.error("Не удалось получить рабочий лист Boss.")
-        return
+        # Уведомление за 5 минут до появления и добавление реакций. Повторы отсекает планировщик
+        # по uid записи и id убийства, так что разные убийства одного босса уведомляются каждое
+        msg = await rest.send(channel, f"@everyone Босс \"{boss_name}\" появится в зоне уровня \"{zone}\", "
+                                       f"в режиме \"{difficulty}\" на канале \"{alert_channel}\" через {time_to_spawn} минут"
+                                       f"{boss.window_text()}.")
+        # Ответ ждём в on_raw_reaction_add, а не здесь: планировщик не простаивает,
+        # и одновременно может висеть сколько угодно уведомлений
+        self.pending_alerts[msg.id] = boss
+        alert_store.save_alert(self.guild_id, msg.id, boss, now + ALERT_CONFIRM_TIMEOUT)
+        self.push_schedule(now + ALERT_CONFIRM_TIMEOUT, "expire", msg.id)
+        try:
+            await rest.add_reactions(msg, "👍", "👎")  # палец вверх, палец вниз
+        except discord.HTTPException as e:
+            # Без реакций ответ всё ещё можно поставить вручную, уведомление не теряем
+            logging.error(f"Не удалось добавить реакции к уведомлению о {boss_name}: {e}")
 
-    try:
-        row_index = boss["row_index"]
-        worksheet.update_cell(row_index, 6, appeared)  # Обновляем столбец "Появился" (6-й столбец)
-        worksheet.update_cell(row_index, 7, reaction_time)  # Обновляем столбец "Тайм" (7-й столбец)
-        logging.info(f"Статус босса {boss['name']} обновлен: {appeared}, Тайм: {reaction_time}")
-    except Exception as e:
-        logging.error("Ошибка при обновлении статуса босса %s: %s", boss["name"], e)
-
-@bot.event
-async def on_ready():
-    logging.info(f'Бот успешно запущен как {bot.user}')
-    check_boss_spawn.start()  # Запускаем задачу проверки появления боссов
-
-@bot.command(name='s', aliases=['spawn', 'спавн', 'с', 'c', 'ы'])  # Объединяем все команды в одну
-async def spawn_bosses(ctx):
-    await update_boss_cache()  # Обновляем кэш боссов перед отправкой
-    if ctx.channel.id != 1278955149208846356:
-        await ctx.send("Эта команда может использоваться только в канале для спавнов.")
-        return
+        logging.info(f"Уведомление о спавне босса {boss_name} отправлено в канал для уведомлений.")
 
-    now = datetime.datetime.now()
-    response_message = []
+    async def on_raw_reaction_add(self, payload):
+        # Быстрый выход для всех реакций, кроме ответов на наши уведомления
+        if payload.message_id not in self.pending_alerts or payload.user_id == bot.user.id:
+            return
 
-    for boss in boss_cache:
-        boss_name = boss["name"]
-        kill_time_str = boss["kill_time"]
-        zone = boss["zone"]
-        difficulty = boss["difficulty"]
-        alert_channel = boss["channel"]
+        emoji = str(payload.emoji)
+        if emoji not in ["👍", "👎"]:
+            return
 
-        if not kill_time_str:
-            logging.warning(f"Пропускаем босса {boss_name}, так как kill_time пуст.")
-            continue
+        boss = self.take_alert(payload.message_id)
+        appeared = "Да" if emoji == "👍" else "Нет"
+        await self.finish_alert(boss, appeared, datetime.datetime.now().strftime("%d.%m.%Y %H:%M"))
+
+    def take_alert(self, message_id):
+        boss = self.pending_alerts.pop(message_id, None)
+        if boss is not None:
+            alert_store.delete_alert(message_id)
+        return boss
+
+    def restore_alert(self, message_id, boss, expires_at):
+        self.pending_alerts[message_id] = boss
+        # Истёкшее за время простоя уведомление планировщик закроет сразу после запуска
+        self.push_schedule(expires_at, "expire", message_id)
+
+    async def finish_alert(self, boss, appeared=None, reaction_time=None):
+        """Запоминает ответ на уведомление (если он есть) и ставит убийство в очередь на перенос в архив."""
+        remember_outcome(boss, appeared, reaction_time)
+        if not boss.kill_id:
+            logging.warning("У записи босса %s нет id, в архив её перенесёт следующая синхронизация.", boss.name)
+            return
+        # Журнал переживёт перезапуск и соберёт переносы за цикл в один запрос
+        row = [boss.kill_id, boss.name, boss.kill_time.strftime("%d.%m.%Y %H:%M"), boss.zone, boss.difficulty,
+               boss.channel, appeared or '', reaction_time or '']
+        journal.append('archive', {'spreadsheet': self.config.spreadsheet, 'row': row})
+        logging.info(f"Запись для босса {boss.name} поставлена в очередь на перенос в архив.")
+
+    def forget_row(self, row_index, boss=None):
+        """Убирает удалённую строку из кэша и сдвигает индексы записей ниже неё."""
+        if boss is not None:
+            self.boss_cache.pop(boss.uid, None)
+            self.unschedule_boss(boss.uid)
+        for record in self.boss_cache.values():
+            if record.row_index > row_index:
+                record.row_index -= 1
+
+        # Строки ниже synced_rows кэш ещё не видел: их удаление не сдвигает уже учтённую часть листа
+        if row_index <= self.synced_rows:
+            if row_index == self.synced_rows:
+                self.last_row_values = None  # Содержимое новой последней строки неизвестно, сверку пропустим
+            self.synced_rows -= 1
+
+    async def spawn_bosses(self, ctx):
+        # Отвечаем из кэша в памяти: его обновляют фоновая синхронизация и событие boss_kill
+        if self.config.spawn_channel_id is not None and ctx.channel.id != self.config.spawn_channel_id:
+            await rest.send(ctx.channel, "Эта команда может использоваться только в канале для спавнов.")
+            return
 
-        try:
-            kill_time = datetime.datetime.strptime(kill_time_str, "%d.%m.%Y %H:%M")
-        except ValueError as e:
-            logging.warning("Ошибка при разборе времени: %s. Строка: %s", e, kill_time_str)
+        now = datetime.datetime.now()
+        response_message = []
+
+        for boss in self.boss_cache.values():
+            boss_name = boss.name
+            zone = boss.zone
+            difficulty = boss.difficulty
+            alert_channel = boss.channel
+
+            time_to_spawn = (boss.spawn_time - now).total_seconds() / 60
+
+            if time_to_spawn > 5:  # Проверяем, осталось ли больше 5 минут
+                response_message.append(
+                    f"Босс \"{boss_name}\" появится в зоне уровня \"{zone}\", в режиме \"{difficulty}\" на канале \"{alert_channel}\" через {round(time_to_spawn)} минут{boss.window_text()}."
+                )
+
+        if response_message:
+            await rest.send(ctx.channel, "\n".join(response_message))
+        else:
+            await rest.send(ctx.channel, "Нет боссов, которые появятся через более чем 5 минут.")
+
+
+def restore_alerts():
+    """Поднимает с диска открытые уведомления и уже уведомлённые убийства."""
+    for guild_id, kill_ids in alert_store.load_notified().items():
+        state = get_state(guild_id)
+        if state is not None:
+            state.notified_kills |= kill_ids
+    restored = 0
+    for guild_id, message_id, boss, expires_at in alert_store.load_alerts():
+        state = get_state(guild_id)
+        if state is None:
+            alert_store.delete_alert(message_id)  # Сервер убрали из настроек
             continue
+        state.restore_alert(message_id, boss, expires_at)
+        restored += 1
+    if restored:
+        logging.info("Восстановлено уведомлений, ждущих ответа: %d", restored)
+
+
+def boss_lock(spreadsheet):
+    lock = boss_locks.get(spreadsheet)
+    if lock is None:
+        lock = boss_locks[spreadsheet] = asyncio.Lock()
+    return lock
+
+
+def get_state(guild_id):
+    """Состояние спавнов сервера; None, если сервер не описан в настройках."""
+    state = states.get(guild_id)
+    if state is None:
+        config = guilds.get(guild_id)
+        if config is None:
+            return None
+        state = states[guild_id] = GuildSpawns(guild_id, config)
+    return state
+
+
+def remember_outcome(boss, appeared, reaction_time):
+    """Кладёт ответ на уведомление в историю появлений и уточняет прогноз для этого босса."""
+    if appeared == "Да":
+        outcome = respawn.APPEARED
+        appeared_at = datetime.datetime.strptime(reaction_time, "%d.%m.%Y %H:%M")
+    else:
+        outcome = respawn.MISSED if appeared == "Нет" else respawn.UNKNOWN
+        appeared_at = None
+    try:
+        respawn.add(boss.name, boss.difficulty, boss.channel, boss.kill_time, outcome, appeared_at)
+    except Exception as e:
+        logging.error("Ошибка при записи истории появления босса %s: %s", boss.name, e)
+        return
+    if outcome == respawn.APPEARED:
+        # История общая: новое окно сдвигает уведомления на всех серверах
+        for state in states.values():
+            state.refresh_predictions(boss.name)
 
-        next_spawn_time = kill_time + datetime.timedelta(minutes=boss_spawn_times.get(boss_name, 0))
-        time_to_spawn = (next_spawn_time - now).total_seconds() / 60
 
-        if time_to_spawn > 5:  # Проверяем, осталось ли больше 5 минут
-            response_message.append(
-                f"Босс \"{boss_name}\" появится в зоне уровня \"{zone}\", в режиме \"{difficulty}\" на канале \"{alert_channel}\" через {round(time_to_spawn)} минут."
-            )
+async def commit_boss_archive(entries):
+    """Переносит обработанные убийства в архив: один batch_update на таблицу."""
+    failed = []
+    for spreadsheet, group in data.by_spreadsheet(entries).items():
+        if not await archive_kills(spreadsheet, [row for _, row in group]):
+            failed.extend(entry_id for entry_id, _ in group)
+    return failed
 
-    if response_message:
-        await ctx.send("\n".join(response_message))
-    else:
-        await ctx.send("Нет боссов, которые появятся через более чем 5 минут.")
 
-# Запуск бота
-if __name__ == "__main__":
-    TOKEN = os.getenv('DISCORD_TOKEN')
-    if TOKEN is None:
-        logging.error("Токен Discord не найден. Проверьте ваш файл .env.")
-    else:
-        bot.run(TOKEN)
\ No newline at end of file
+async def archive_kills(spreadsheet, entries):
+    try:
+        worksheet = await sheets.get_worksheet(BOSS_SHEET, spreadsheet, priority=sheets.PRIORITY_LOW)
+    except Exception as e:
+        logging.error("Ошибка при получении рабочего листа Boss таблицы %s: %s", spreadsheet, e)
+        return False
+    archive = await get_archive_worksheet(spreadsheet)
+    if archive is None:
+        return False
+    async with boss_lock(spreadsheet):
+        return await move_to_archive(spreadsheet, worksheet, archive, entries)
+
+
+async def move_to_archive(spreadsheet, worksheet, archive, entries):
+    # Номера строк берём из таблицы прямо перед удалением, по id
+    ids = await sheets.call(worksheet.col_values, data.KILL_ID_COLUMN, priority=sheets.PRIORITY_LOW)
+    positions = {}
+    for row_index, kill_id in enumerate(ids, start=1):
+        if kill_id and row_index > 1:
+            positions.setdefault(kill_id, row_index)
+
+    rows, moved = [], {}
+    for kill_id, *cells in entries:
+        row_index = positions.get(kill_id)
+        if row_index is None or kill_id in moved:
+            logging.info("Убийство %s уже убрано из листа Boss.", kill_id)
+            continue
+        moved[kill_id] = row_index
+        rows.append(cells + [kill_id])
+    if not rows:
+        return True
+
+    requests = [{'appendCells': {
+        'sheetId': archive.id,
+        'rows': [{'values': [{'userEnteredValue': {'stringValue': str(cell)}} for cell in row]} for row in rows],
+        'fields': 'userEnteredValue',
+    }}]
+    # Снизу вверх и соседние строки одним диапазоном: удаление не сдвигает ещё не удалённые строки
+    for first, last in reversed(row_ranges(sorted(moved.values()))):
+        requests.append({'deleteDimension': {'range': {
+            'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': first - 1, 'endIndex': last,
+        }}})
+    try:
+        handle = await sheets.handles.spreadsheet(spreadsheet, priority=sheets.PRIORITY_LOW)
+        await sheets.call(handle.batch_update, {'requests': requests}, priority=sheets.PRIORITY_LOW)
+    except Exception as e:
+        logging.error("Ошибка при переносе убийств в архив: %s", e)
+        return False
+
+    # Одну таблицу могут делить несколько серверов: строки убираем из кэша каждого
+    sharing = [state for state in states.values() if state.config.spreadsheet == spreadsheet]
+    by_id = [{record.kill_id: record for record in state.boss_cache.values() if record.kill_id}
+             for state in sharing]
+    for kill_id, row_index in sorted(moved.items(), key=lambda item: -item[1]):
+        mirror.delete_row(mirror.sheet_key(BOSS_SHEET, spreadsheet), row_index)
+        for state, records in zip(sharing, by_id):
+            state.forget_row(row_index, records.get(kill_id))
+    logging.info("Перенесено в архив таблицы %s убийств: %d", spreadsheet, len(rows))
+    return True
+
+
+def row_ranges(row_indexes):
+    """Сливает отсортированные номера строк в диапазоны (первая, последняя)."""
+    ranges = []
+    for row_index in row_indexes:
+        if ranges and ranges[-1][1] == row_index - 1:
+            ranges[-1][1] = row_index
+        else:
+            ranges.append([row_index, row_index])
+    return ranges
+
+
+async def get_archive_worksheet(spreadsheet):
+    try:
+        return await sheets.get_worksheet(ARCHIVE_SHEET, spreadsheet, priority=sheets.PRIORITY_LOW)
+    except gspread.exceptions.WorksheetNotFound:
+        pass
+    except Exception as e:
+        logging.error("Ошибка при получении листа %s: %s", ARCHIVE_SHEET, e)
+        return None
+    try:
+        handle = await sheets.handles.spreadsheet(spreadsheet, priority=sheets.PRIORITY_LOW)
+        worksheet = await sheets.call(handle.add_worksheet, title=ARCHIVE_SHEET, rows=1,
+                                      cols=len(ARCHIVE_HEADER), priority=sheets.PRIORITY_LOW)
+        await sheets.call(worksheet.batch_update, [{'range': 'A1', 'values': [ARCHIVE_HEADER]}],
+                          priority=sheets.PRIORITY_LOW)
+        logging.info("Создан лист %s в таблице %s", ARCHIVE_SHEET, spreadsheet)
+        return worksheet
+    except Exception as e:
+        logging.error("Не удалось создать лист %s: %s", ARCHIVE_SHEET, e)
+        return None
+
+
+@tasks.loop(minutes=15)
+async def refresh_boss_cache():
+    for state in list(states.values()):
+        await state.update_boss_cache(force=True)
+
+
+def start_guild(guild):
+    state = get_state(guild.id)
+    if state is not None:
+        state.start()
+    return state
+
+
+def start_spawn_tasks():
+    global history_loaded
+    if not history_loaded:
+        # Окна появления нужны уже при первом разборе листа Boss
+        respawn.load(boss_spawn_times)
+        history_loaded = True
+    # on_ready приходит и после переподключения: запускаем задачи один раз
+    for guild in bot.guilds:
+        start_guild(guild)
+    if not refresh_boss_cache.is_running():
+        refresh_boss_cache.start()  # Периодически подтягиваем убийства из таблицы
+
+
+class SpawnCog(commands.Cog):
+    """Уведомления о появлении боссов и команда !s."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        start_spawn_tasks()
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        state = start_guild(guild)
+        if state is not None:
+            await state.update_boss_cache(force=True)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        state = states.get(payload.guild_id)
+        if state is not None:
+            await state.on_raw_reaction_add(payload)
+
+    @commands.Cog.listener()
+    async def on_boss_kill(self, spreadsheet, rows):
+        # Убийство записано этим же процессом: догружаем хвост листа, не дожидаясь 15 минут
+        for state in list(states.values()):
+            if state.config.spreadsheet == spreadsheet:
+                await state.update_boss_cache(force=True)
+
+    @commands.command(name='s', aliases=['spawn', 'спавн', 'с', 'c', 'ы'])  # Объединяем все команды в одну
+    async def spawn(self, ctx):
+        state = states.get(ctx.guild.id) if ctx.guild else None
+        if state is not None:
+            await state.spawn_bosses(ctx)
+
+    @commands.command(name='respawn', aliases=['респ'])
+    async def respawn(self, ctx):
+        report = respawn.report() or "Подтверждённых появлений пока нет, используются интервалы из таблицы."
+        await rest.send(ctx.channel, report[:1900])
+
+    def cog_unload(self):
+        refresh_boss_cache.cancel()
+        for state in states.values():
+            state.stop()
+
+
+journal.register('archive', commit_boss_archive, delay=ARCHIVE_FLUSH_DELAY)
+
+
+async def setup(client):
+    global bot
+    bot = client
+    # Расширение грузится в setup_hook: ответы на старые уведомления придут уже после этого
+    restore_alerts()
+    await client.add_cog(SpawnCog(client))
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data  # noqa: E402
+import journal  # noqa: E402
+import mirror  # noqa: E402
+import respawn  # noqa: E402
+import sheets  # noqa: E402
+import spawn  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+
+
+@pytest.fixture
+def google(tmp_path, monkeypatch):
+    """Google Sheets в памяти без задержки и квоты; журнал, зеркало и история - во временном каталоге."""
+    client = fakes.FakeGoogle(latency=0, quota=100000)
+    monkeypatch.setattr(sheets, 'client', client)
+    monkeypatch.setattr(sheets, 'gateway', sheets.SheetsGateway(requests_per_minute=100000))
+    monkeypatch.setattr(sheets, 'handles', sheets.HandleCache())
+    for store, name in ((journal.journal, 'journal'), (mirror.mirror, 'mirror')):
+        monkeypatch.setattr(store, 'path', str(tmp_path / f'{name}.sqlite3'))
+        monkeypatch.setattr(store, 'db', None)
+    monkeypatch.setattr(respawn, 'history', respawn.KillHistory(str(tmp_path / 'history.sqlite3')))
+    monkeypatch.setattr(spawn.alert_store, 'db', None)
+    # Блокировки привязываются к циклу событий, а каждый тест запускает свой
+    monkeypatch.setattr(data, 'weeks', {})
+    monkeypatch.setattr(data, 'week_lock', asyncio.Lock())
+    monkeypatch.setattr(spawn, 'states', {})
+    monkeypatch.setattr(spawn, 'boss_locks', {})
+    return client
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+
+import data
+import sheets
+
+TODAY = datetime.date.today()
+MONDAY = data.week_start(TODAY)
+LAST_MONDAY = MONDAY - datetime.timedelta(days=7)
+
+
+def week_header(monday):
+    return ['Ник'] + [(monday + datetime.timedelta(days=day)).strftime(data.DATE_FORMAT) for day in range(7)]
+
+
+def day(monday, offset):
+    return (monday + datetime.timedelta(days=offset)).strftime(data.DATE_FORMAT)
+
+
+def test_coalesce_marks_merges_times_of_one_day():
+    entries = [(1, ['Alice', f'{day(MONDAY, 0)} 10:00']), (2, ['Alice', day(MONDAY, 0)]),
+               (3, ['Bob', f'{day(MONDAY, 1)} 23:59']), (4, ['Alice', day(MONDAY, 1)])]
+    pending, entry_ids = data.coalesce_marks(entries)
+    assert pending == {('Alice', day(MONDAY, 0)): 2, ('Bob', day(MONDAY, 1)): 1, ('Alice', day(MONDAY, 1)): 1}
+    assert entry_ids[('Alice', day(MONDAY, 0))] == [1, 2]
+
+
+def test_new_week_sheet_takes_roster_of_previous_week(google):
+    google.create(sheets.SPREADSHEET_NAME).add(data.week_title(LAST_MONDAY),
+                                              [week_header(LAST_MONDAY), ['Bob', '1'], ['Alice']])
+
+    layout = asyncio.run(data.get_week_layout(sheets.SPREADSHEET_NAME, MONDAY))
+
+    values = google.spreadsheets[sheets.SPREADSHEET_NAME].worksheet(data.week_title(MONDAY)).get_all_values()
+    assert values[0] == week_header(MONDAY)
+    assert [row[0] for row in values[1:]] == ['Bob', 'Alice']
+    assert layout.rows == {'Bob': 2, 'Alice': 3}
+    assert layout.next_row == 4
+
+
+def test_marks_add_to_existing_counts(google):
+    google.create(sheets.SPREADSHEET_NAME).add(data.week_title(MONDAY),
+                                              [week_header(MONDAY), ['Alice', '', '2']])
+    entries = [(1, ['Alice', day(MONDAY, 1)]), (2, ['Alice', day(MONDAY, 1)]), (3, ['Carol', day(MONDAY, 0)])]
+
+    failed = asyncio.run(data.commit_marks(sheets.SPREADSHEET_NAME, entries))
+
+    assert failed == []
+    values = google.spreadsheets[sheets.SPREADSHEET_NAME].worksheet(data.week_title(MONDAY)).get_all_values()
+    assert values[1][:3] == ['Alice', '', '4']
+    assert values[2][:2] == ['Carol', '1']
+
+
+def test_failed_week_keeps_only_its_marks(google):
+    spreadsheet = google.create(sheets.SPREADSHEET_NAME)
+    spreadsheet.add(data.week_title(MONDAY), [week_header(MONDAY)])
+    old = spreadsheet.add(data.week_title(LAST_MONDAY), [week_header(LAST_MONDAY)])
+    # В листе прошлой недели нет запаса строк, а расширить его не удаётся
+    old.row_count = 1
+
+    def add_rows(rows):
+        raise RuntimeError("add_rows failed")
+    old.add_rows = add_rows
+
+    entries = [(1, ['Alice', day(MONDAY, 0)]), (2, ['Bob', day(LAST_MONDAY, 3)]), (3, ['Alice', day(MONDAY, 0)])]
+    failed = asyncio.run(data.commit_marks(sheets.SPREADSHEET_NAME, entries))
+
+    assert failed == [2]
+    assert (sheets.SPREADSHEET_NAME, LAST_MONDAY) not in data.weeks
+    assert (sheets.SPREADSHEET_NAME, MONDAY) in data.weeks
+    values = spreadsheet.worksheet(data.week_title(MONDAY)).get_all_values()
+    assert values[1][:2] == ['Alice', '2']
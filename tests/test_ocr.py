@@ -0,0 +1,21 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+
+import ocr
+
+pytest.importorskip('cv2')
+pytest.importorskip('pytesseract')
+if shutil.which('tesseract') is None:
+    pytest.skip("tesseract не установлен", allow_module_level=True)
+
+IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'image.png')
+
+
+def test_read_stats_from_sample_screenshot():
+    with open(IMAGE, 'rb') as f:
+        data = f.read()
+    stats = asyncio.run(ocr.read_stats(data))
+    assert stats == {'gear_score': '135834', 'attack': '191', 'accuracy': '315', 'defence': '290'}
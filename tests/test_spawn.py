@@ -0,0 +1,85 @@
+import asyncio
+import datetime
+
+import guilds
+import journal
+import mirror
+import sheets
+import spawn
+
+HEADER = ['Босс', 'Время', 'Зона', 'Сложность', 'Канал', 'Появился', 'Тайм', 'ID']
+
+
+def kill_time(hours_ago):
+    return (datetime.datetime.now() - datetime.timedelta(hours=hours_ago)).strftime("%d.%m.%Y %H:%M")
+
+
+def boss_rows(*names, hours_ago=1):
+    return [[name, kill_time(hours_ago), '5', 'Обычный', 'Канал 1', '', '', f'id-{name}'] for name in names]
+
+
+def test_forget_row_shifts_records_below(google):
+    state = spawn.GuildSpawns(1, guilds.default)
+    records = [spawn.parse_boss_row(row, index) for index, row in enumerate(boss_rows('A', 'B', 'C'), start=2)]
+    state.boss_cache = {record.uid: record for record in records}
+    state.synced_rows = 4
+    state.last_row_values = spawn.row_signature(boss_rows('C')[0])
+
+    state.forget_row(3, records[1])
+    assert {record.name: record.row_index for record in state.boss_cache.values()} == {'A': 2, 'C': 3}
+    assert state.synced_rows == 3
+    assert state.last_row_values is not None
+
+    # Удалена последняя учтённая строка: сверять хвост больше не с чем
+    state.forget_row(3, records[2])
+    assert state.synced_rows == 2
+    assert state.last_row_values is None
+
+
+def test_forget_row_below_synced_part_keeps_tail(google):
+    state = spawn.GuildSpawns(1, guilds.default)
+    record = spawn.parse_boss_row(boss_rows('A')[0], 2)
+    state.boss_cache = {record.uid: record}
+    state.synced_rows = 2
+    state.last_row_values = spawn.row_signature(boss_rows('A')[0])
+
+    # Строку 5 дописали после последней синхронизации, кэш её ещё не видел
+    state.forget_row(5)
+    assert record.row_index == 2
+    assert state.synced_rows == 2
+    assert state.last_row_values == spawn.row_signature(boss_rows('A')[0])
+
+
+def test_finished_alert_moves_kill_to_archive(google):
+    spreadsheet = google.create(sheets.SPREADSHEET_NAME)
+    worksheet = spreadsheet.add(spawn.BOSS_SHEET, [HEADER] + boss_rows('Kiaron', 'Grish'))
+
+    async def scenario():
+        state = spawn.get_state(1)
+        await state.update_boss_cache(force=True)
+        kiaron = next(record for record in state.boss_cache.values() if record.name == 'Kiaron')
+        await state.finish_alert(kiaron, 'Нет', kill_time(0))
+        await journal.journal.flush('archive')
+        return state
+
+    state = asyncio.run(scenario())
+
+    assert [row[0] for row in worksheet.get_all_values()] == ['Босс', 'Grish']
+    archive = spreadsheet.worksheet(spawn.ARCHIVE_SHEET).get_all_values()
+    assert [(row[0], row[5], row[7]) for row in archive[1:]] == [('Kiaron', 'Нет', 'id-Kiaron')]
+    assert [(record.name, record.row_index) for record in state.boss_cache.values()] == [('Grish', 2)]
+    assert state.synced_rows == 2
+    assert [row[0] for row in mirror.rows(state.boss_sheet)] == ['Босс', 'Grish']
+
+
+def test_kill_without_alert_still_goes_to_archive(google):
+    google.create(sheets.SPREADSHEET_NAME).add(spawn.BOSS_SHEET, [HEADER] + boss_rows('Kiaron', hours_ago=48))
+
+    async def scenario():
+        state = spawn.get_state(1)
+        await state.update_boss_cache(force=True)
+        # Босс давно появился: уведомление не отправляется, но убийство не должно застрять в листе
+        await state.send_spawn_alert(next(iter(state.boss_cache.values())))
+
+    asyncio.run(scenario())
+    assert [payload['row'][0] for _, payload in journal.journal.pending('archive')] == ['id-Kiaron']
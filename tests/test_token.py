@@ -0,0 +1,42 @@
+import pytest
+
+import TOKEN
+
+
+def test_threshold_alert_fires_once_until_price_drops_below_hysteresis():
+    alert = TOKEN.ThresholdAlert(1.0, hysteresis=0.05)
+    assert alert.update(0.9) is False
+    assert alert.update(1.0) is True
+    # Колебания около порога не шлют повторных уведомлений
+    assert alert.update(0.97) is False
+    assert alert.update(1.02) is False
+    # Откат ниже 0.95 снова взводит порог
+    assert alert.update(0.94) is False
+    assert alert.armed
+    assert alert.update(1.01) is True
+
+
+@pytest.mark.parametrize('text, price', [
+    ('0.75', 0.75),
+    ('0,75', 0.75),
+    ('0.750', 0.75),
+    ('1,234.56', 1234.56),
+    ('1.234,56', 1234.56),
+    ('1,234,567', 1234567.0),
+    ('1234.567', 1234.567),
+    ('12.', 12.0),
+])
+def test_parse_price(text, price):
+    assert TOKEN.parse_price(text) == price
+
+
+@pytest.mark.parametrize('text', ['1,234', '1.234', '1,23,4.5', '1.2.3'])
+def test_parse_price_rejects_ambiguous_values(text):
+    assert TOKEN.parse_price(text) is None
+
+
+def test_html_source_reads_price_from_row_of_symbol():
+    source = TOKEN.HtmlSource('https://example.com', ['CROW'])
+    body = ("<table><tr><td>WEMIX</td><td>$1,234.50</td></tr>"
+            "<tr><td>CROW</td><td>$ 0.7812</td></tr></table>")
+    assert source.parse(body) == {'CROW': 0.7812}
@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import discord
+from discord.ext import commands
+import metrics
+import rest
+
+# Сторожевой поток: цикл событий раз в HEARTBEAT_INTERVAL отмечается, а поток
+# проверяет отметку. Если её нет дольше порога, значит в корутине выполняется
+# блокирующий код - снимаем стек потока цикла и группируем такие случаи по месту.
+STALL_THRESHOLD = float(os.getenv('WATCHDOG_THRESHOLD', '0.5'))  # Секунды
+HEARTBEAT_INTERVAL = 0.1
+SAMPLE_INTERVAL = 0.005  # Период выборки профилировщика, секунды
+PROFILE_LIMIT = 10 * 60  # Профилировщик сам останавливается через столько секунд
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+stalls_total = metrics.counter('event_loop_stalls_total', "Остановки цикла событий дольше порога")
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def project_frame(stack):
+    """Самый глубокий кадр из кода бота: именно его и нужно чинить."""
+    for entry in reversed(stack):
+        if entry.filename.startswith(PROJECT_DIR):
+            return f"{os.path.relpath(entry.filename, PROJECT_DIR)}:{entry.lineno} {entry.name}"
+    return None
+
+
+class Watchdog(threading.Thread):
+    """Замечает остановки цикла событий и запоминает, где они происходят."""
+
+    def __init__(self, loop_thread_id, threshold=STALL_THRESHOLD):
+        super().__init__(name='watchdog', daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.stopped = threading.Event()
+        self.stall = None  # Группа текущей остановки
+        # (наш кадр, самый глубокий кадр) -> {"count", "total", "longest", "stack"}
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def beat(self):
+        self.last_beat = time.monotonic()
+
+    def run(self):
+        while not self.stopped.wait(self.threshold / 4):
+            lag = time.monotonic() - self.last_beat
+            if lag > self.threshold:
+                if self.stall is None:
+                    self.stall = self.capture()
+                with self.lock:
+                    self.stall["current"] = lag
+            elif self.stall is not None:
+                self.finish()
+
+    def capture(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        innermost = f"{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} {stack[-1].name}" if stack else '?'
+        key = (project_frame(stack) or '?', innermost)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = {"count": 0, "total": 0.0, "longest": 0.0,
+                                            "stack": ''.join(traceback.format_list(stack[-15:]))}
+            group["count"] += 1
+            group["current"] = 0.0
+        stalls_total.inc()
+        # Стек пишем в лог один раз на место, дальше только считаем повторы
+        if group["count"] == 1:
+            logging.warning("Цикл событий остановлен дольше %.2f с в %s (%s):\n%s",
+                            self.threshold, key[0], key[1], group["stack"])
+        return group
+
+    def finish(self):
+        with self.lock:
+            duration = self.stall.pop("current", 0.0)
+            self.stall["total"] += duration
+            self.stall["longest"] = max(self.stall["longest"], duration)
+        if duration > self.threshold * 4:
+            logging.warning("Цикл событий простоял %.2f с", duration)
+        self.stall = None
+
+    def report(self, limit=10):
+        with self.lock:
+            groups = sorted(self.groups.items(), key=lambda item: -item[1]["total"])[:limit]
+        if not groups:
+            return f"Остановок цикла событий дольше {self.threshold:.2f} с не было."
+        lines = [f"Остановки цикла событий дольше {self.threshold:.2f} с (раз, всего, дольше всего):"]
+        for (ours, innermost), group in groups:
+            lines.append(f"{ours} -> {innermost}: {group['count']}, {group['total']:.1f} с, {group['longest']:.2f} с")
+        return "\n".join(lines)
+
+
+class SamplingProfiler(threading.Thread):
+    """Снимает стек потока цикла событий и копит его в свёрнутом виде (folded stacks)."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL, limit=PROFILE_LIMIT):
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.limit = limit
+        self.samples = collections.Counter()
+        self.stopped = threading.Event()
+        self.started_at = None
+
+    def run(self):
+        self.started_at = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.samples[';'.join(reversed(names))] += 1
+            if time.monotonic() - self.started_at > self.limit:
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def dump(self, path):
+        """Пишет файл для flamegraph.pl или speedscope: 'кадр;кадр;... количество'."""
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return sum(self.samples.values())
+
+
+watchdog = None
+profiler = None
+heartbeat_task = None
+
+
+async def heartbeat():
+    while True:
+        watchdog.beat()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def start():
+    """Запускает сторожевой поток; вызывается из цикла событий."""
+    global watchdog, heartbeat_task
+    if watchdog is None:
+        watchdog = Watchdog(threading.get_ident())
+        watchdog.start()
+        heartbeat_task = asyncio.create_task(heartbeat())
+    return watchdog
+
+
+def start_profiler():
+    global profiler
+    if profiler is not None and profiler.is_alive():
+        return False
+    profiler = SamplingProfiler(watchdog.loop_thread_id)
+    profiler.start()
+    return True
+
+
+def stop_profiler():
+    """Останавливает профилировщик и возвращает (путь к файлу, число выборок) или None."""
+    global profiler
+    if profiler is None:
+        return None
+    current, profiler = profiler, None
+    current.stop()
+    path = f"profile-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return path, current.dump(path)
+
+
+class WatchdogCog(commands.Cog):
+    """Команды !stalls и !profile для администраторов."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(name='stalls')
+    @commands.has_permissions(administrator=True)
+    async def stalls(self, ctx):
+        await rest.send(ctx.channel, f"```\n{watchdog.report()[:1900]}\n```")
+
+    @commands.command(name='profile')
+    @commands.has_permissions(administrator=True)
+    async def profile(self, ctx, action='start'):
+        if action == 'start':
+            if start_profiler():
+                await rest.send(ctx.channel, f"Профилировщик запущен, остановится сам через {PROFILE_LIMIT // 60} мин. "
+                                             "Остановить: !profile stop")
+            else:
+                await rest.send(ctx.channel, "Профилировщик уже запущен.")
+        elif action == 'stop':
+            # Остановка ждёт поток профилировщика, поэтому не в цикле событий
+            result = await asyncio.to_thread(stop_profiler)
+            if result is None:
+                await rest.send(ctx.channel, "Профилировщик не запущен.")
+                return
+            path, samples = result
+            await rest.send(ctx.channel, f"Выборок: {samples}, файл {path} (flamegraph.pl или speedscope).",
+                            file=discord.File(path))
+        else:
+            await rest.send(ctx.channel, "Использование: !profile start | !profile stop")
+
+    def cog_unload(self):
+        global watchdog, heartbeat_task
+        if profiler is not None:
+            stop_profiler()
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
+            heartbeat_task = None
+        if watchdog is not None:
+            watchdog.stopped.set()
+            watchdog = None
+
+
+async def setup(client):
+    start()
+    await client.add_cog(WatchdogCog(client))
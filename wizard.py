@@ -0,0 +1,170 @@
+import functools
+import inspect
+import json
+import logging
+import sqlite3
+import time
+import rest
+import sessions
+
+# Мастер - это запись состояния (номер шага и ответы), а не корутина, ждущая
+# bot.wait_for: сообщение находит свою сессию по id канала за O(1), а сами
+# записи хранятся в SQLite и переживают перезапуск бота
+WIZARD_FILE = 'wizards.sqlite3'
+STEP_TIMEOUT = 10 * 60  # Сколько ждём ответа на шаг по умолчанию, секунды
+
+
+class Step:
+    """Шаг мастера: вопрос и разбор ответа.
+
+    prompt - строка или функция от уже собранных ответов. parse получает
+    сообщение и ответы и возвращает значение (можно корутиной); ValueError
+    означает, что ответ не подошёл и шаг нужно повторить.
+    """
+
+    def __init__(self, key, prompt, parse=None, error=None, timeout=STEP_TIMEOUT):
+        self.key = key
+        self.prompt = prompt
+        self.parse = parse or (lambda message, answers: message.content.strip())
+        self.error = error
+        self.timeout = timeout
+
+    def render(self, answers):
+        return self.prompt(answers) if callable(self.prompt) else self.prompt
+
+
+class WizardStore:
+    """Состояние открытых мастеров на SQLite."""
+
+    def __init__(self, path=WIZARD_FILE):
+        self.path = path
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS wizard_sessions (
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                step INTEGER NOT NULL,
+                answers TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (kind, user_id)
+            )""")
+        return self.db
+
+    def save(self, session):
+        # Истечение сессии считается по monotonic, а на диск пишем настенное время
+        expires_at = time.time() + session.expires_at - time.monotonic()
+        self.connect().execute(
+            "INSERT OR REPLACE INTO wizard_sessions (kind, user_id, channel_id, step, answers, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (session.kind, session.user_id, session.channel_id, session.data["step"],
+             json.dumps(session.data["answers"], ensure_ascii=False), expires_at))
+
+    def delete(self, kind, user_id):
+        self.connect().execute("DELETE FROM wizard_sessions WHERE kind = ? AND user_id = ?", (kind, user_id))
+
+    def load(self, kind):
+        rows = self.connect().execute(
+            "SELECT user_id, channel_id, step, answers, expires_at FROM wizard_sessions WHERE kind = ?",
+            (kind,)).fetchall()
+        return [(user_id, channel_id, step, json.loads(answers), expires_at)
+                for user_id, channel_id, step, answers, expires_at in rows]
+
+
+class Wizard:
+    """Пошаговый мастер в отдельном канале.
+
+    on_complete(session, channel, answers) вызывается после последнего шага,
+    on_expire(session) - когда сессия истекла: по таймауту шага или после finish().
+    """
+
+    def __init__(self, kind, steps, on_complete, on_expire=None):
+        self.kind = kind
+        self.steps = steps
+        self.on_complete = on_complete
+        self.on_expire = on_expire
+
+    def open(self, user_id):
+        """Открывает сессию; бросает sessions.SessionLimitError, если лимит исчерпан."""
+        session = sessions.open(self.kind, user_id, self.steps[0].timeout, on_expire=self.expire)
+        session.data.update(step=0, answers={})
+        return session
+
+    async def begin(self, session, channel):
+        self.bind(session, channel.id)
+        store.save(session)
+        await rest.send(channel, self.steps[0].render(session.data["answers"]))
+
+    def bind(self, session, channel_id):
+        sessions.bind_channel(session, channel_id, functools.partial(self.handle, session))
+
+    async def handle(self, session, message):
+        if message.author.id != session.user_id or session.data.get("busy"):
+            return
+        index = session.data["step"]
+        if index >= len(self.steps):
+            return  # Мастер уже завершён и ждёт закрытия канала
+
+        step = self.steps[index]
+        session.data["busy"] = True  # Пока разбираем ответ, следующие сообщения игнорируем
+        try:
+            try:
+                value = step.parse(message, session.data["answers"])
+                if inspect.isawaitable(value):
+                    value = await value
+            except ValueError as e:
+                await rest.send(message.channel, step.error or str(e))
+                return
+
+            if not sessions.registry.is_open(session):
+                return  # Сессия истекла, пока разбирали ответ
+            session.data["answers"][step.key] = value
+            session.data["step"] = index + 1
+            if index + 1 < len(self.steps):
+                next_step = self.steps[index + 1]
+                sessions.extend(session, next_step.timeout)
+                store.save(session)
+                await rest.send(message.channel, next_step.render(session.data["answers"]))
+            else:
+                store.save(session)
+                await self.on_complete(session, message.channel, session.data["answers"])
+        finally:
+            session.data["busy"] = False
+
+    def finish(self, session, delay):
+        """Завершает мастер: сессия истечёт через delay секунд."""
+        session.data["step"] = len(self.steps)
+        sessions.extend(session, delay)
+        store.save(session)
+
+    async def expire(self, session):
+        store.delete(session.kind, session.user_id)
+        if self.on_expire is not None:
+            await self.on_expire(session)
+
+    async def restore(self, bot):
+        """Поднимает сессии, сохранённые до перезапуска бота."""
+        now = time.time()
+        for user_id, channel_id, step, answers, expires_at in store.load(self.kind):
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                store.delete(self.kind, user_id)
+                continue
+
+            try:
+                session = sessions.open(self.kind, user_id, max(expires_at - now, 0), on_expire=self.expire)
+            except sessions.SessionLimitError:
+                continue
+            session.data.update(step=step, answers=answers)
+            self.bind(session, channel_id)
+            if expires_at > now and step < len(self.steps):
+                await rest.send(channel, self.steps[step].render(answers))
+            logging.info("Восстановлен мастер %s пользователя %s на шаге %d", self.kind, user_id, step)
+
+
+store = WizardStore()